@@ -2,8 +2,6 @@ import os
 import shutil
 import sys
 
-import pandas as pd
-
 # Añadir src al path para imports
 sys.path.append("./src")
 
@@ -11,6 +9,8 @@ from src.config import Config
 from src.data_processor import DataProcessor
 from src.database_manager import DatabaseManager
 from src.embeddings_manager import EmbeddingsManager
+from src.ingestion_job import IngestionJob
+from src.near_duplicates import NearDuplicateDetector
 from src.query_enhancer import QueryEnhancer
 from src.search_engine import PropertySearchEngine
 
@@ -21,43 +21,107 @@ class PropertySearchApp:
 
     # Cargamos y procesamos CSV con separación texto/metadata
     def load_and_process_data(self, csv_file):
+        if Config.STREAMING_INGESTION:
+            return self.load_and_process_data_streaming(csv_file)
+
         print("<<CARGANDO Y PROCESANDO DATOS>>")
         print("=" * 50)
 
-        df = pd.read_csv(csv_file)
+        df = DataProcessor.read_file(csv_file)
         print(f"Archivo cargado: {csv_file}")
 
-        df_clean = DataProcessor.clean_dataframe(df)
-
-        # Generar SOLO textos descriptivos para embeddings
-        print("Generando textos descriptivos (solo texto)...")
-        descriptive_texts = df_clean.apply(
-            DataProcessor.build_descriptive_text, axis=1
-        ).tolist()
-
-        # Generar metadata estructurada separada
-        print("Extrayendo metadata estructurada (numérica/categórica)...")
-        structured_metadata = df_clean.apply(
-            DataProcessor.build_structured_metadata, axis=1
-        ).tolist()
+        # Limpieza, textos descriptivos (solo texto, para embeddings) y metadata
+        # estructurada separada (numérica/categórica); en paralelo si
+        # Config.PROCESSING_WORKERS > 1
+        print("Generando textos descriptivos y metadata estructurada...")
+        df_clean, descriptive_texts, structured_metadata = DataProcessor.process_dataframe(df)
 
         print(f"Ejemplo de texto descriptivo:\n{descriptive_texts[0][:200]}...")
         print(
             f"\nEjemplo de metadata estructurada:\n{list(structured_metadata[0].keys())}"
         )
 
-        # Generar embeddings SOLO del texto descriptivo
-        embeddings_manager = EmbeddingsManager()
-        embeddings = embeddings_manager.generate_embeddings_batch(
-            descriptive_texts, use_large_model=True
-        )
+        # El mismo piso publicado varias veces: se embebe una sola vez
+        if Config.NEAR_DUP_ENABLED:
+            df_clean, descriptive_texts, structured_metadata = NearDuplicateDetector().deduplicate(
+                df_clean, descriptive_texts, structured_metadata
+            )
 
-        # Guardar en bbdd
+        embeddings_manager = EmbeddingsManager()
         db_manager = DatabaseManager()
-        db_manager.add_properties_to_db(
-            df_clean, descriptive_texts, embeddings, structured_metadata
-        )
 
+        # Solo propiedades nuevas o modificadas (ids estables por URL + hash de contenido)
+        changed = db_manager.get_changed_indices(descriptive_texts, structured_metadata)
+        print(f"Propiedades sin cambios (se omiten): {len(descriptive_texts) - len(changed)}")
+        if not changed:
+            print("No hay propiedades nuevas ni modificadas. [OK]")
+            return
+
+        df_clean = df_clean.iloc[changed]
+        descriptive_texts = [descriptive_texts[i] for i in changed]
+        structured_metadata = [structured_metadata[i] for i in changed]
+
+        if Config.CHUNKING_ENABLED:
+            # Multi-vector: un embedding por trozo de cada propiedad
+            chunks_per_property = df_clean.apply(
+                DataProcessor.build_text_chunks, axis=1
+            ).tolist()
+            chunk_texts = [chunk for chunks in chunks_per_property for chunk in chunks]
+            print(f"Trozos generados: {len(chunk_texts)} ({len(chunks_per_property)} propiedades)")
+
+            embeddings = embeddings_manager.generate_embeddings_batch(
+                chunk_texts, use_large_model=True, allow_fallback=False
+            )
+            db_manager.add_property_chunks_to_db(
+                chunks_per_property, embeddings, structured_metadata, descriptive_texts
+            )
+        else:
+            # Generar embeddings SOLO del texto descriptivo
+            embeddings = embeddings_manager.generate_embeddings_batch(
+                descriptive_texts, use_large_model=True, allow_fallback=False
+            )
+
+            # Guardar en bbdd
+            db_manager.add_properties_to_db(
+                df_clean, descriptive_texts, embeddings, structured_metadata
+            )
+
+        print("Datos procesados y guardados correctamente. [OK]")
+
+    # Cargamos el CSV por bloques como trabajo reanudable (memoria constante)
+    def load_and_process_data_streaming(self, csv_file, chunksize=None):
+        print("<<CARGANDO Y PROCESANDO DATOS (STREAMING)>>")
+        print("=" * 50)
+
+        job = IngestionJob.create(csv_file, chunksize=chunksize)
+        print(f"Trabajo de ingesta: {job.job_id}")
+        self._run_job(job)
+
+    # Reanudar un trabajo de ingesta interrumpido desde su último checkpoint
+    def resume_ingestion(self):
+        # Los que otro proceso está ejecutando ahora no se ofrecen
+        pending = [job for job in IngestionJob.list_jobs() if job.get_status()['state'] not in ('completed', 'running')]
+        if not pending:
+            print("No hay trabajos de ingesta pendientes.")
+            return
+
+        print("\nTrabajos pendientes:")
+        for i, job in enumerate(pending, 1):
+            status = job.get_status()
+            print(f"{i}. {job.job_id} - {status['state']} - {status['rows_done']} filas procesadas")
+
+        choice = input("Trabajo a reanudar (número): ")
+        if not choice.isdigit() or not 1 <= int(choice) <= len(pending):
+            print("Opción no válida...")
+            return
+
+        self._run_job(pending[int(choice) - 1])
+
+    def _run_job(self, job):
+        status = job.run()
+        print(f"Filas procesadas: {status['rows_done']}")
+        print(f"Propiedades guardadas: {status['rows_written']} en {status['chunks_done']} bloques")
+        print(f"Tokens usados (estimados): {status['tokens_used']}")
         print("Datos procesados y guardados correctamente. [OK]")
 
     # Función para mostrar estadísticas de la bbdd
@@ -90,7 +154,10 @@ class PropertySearchApp:
             if not query.strip():
                 continue
 
-            results = self.search_engine.search(query, n_results=3)
+            if Config.SPECULATIVE_SEARCH:
+                results = self.search_engine.speculative_search(query, n_results=3)
+            else:
+                results = self.search_engine.search(query, n_results=3)
             self.print_results(query, results)
 
     # Imprimir resultados de búsqueda mejorado
@@ -249,12 +316,13 @@ def main():
         print("3. Buscar propiedades")
         print("4. Probar análisis LLM")
         print("5. Borrar base de datos")
-        print("6. Salir")
+        print("6. Reanudar ingesta interrumpida")
+        print("7. Salir")
 
-        choice = input("\nSelecciona una opción (1-6): ")
+        choice = input("\nSelecciona una opción (1-7): ")
 
         if choice == "1":
-            csv_file = input("Nombre del archivo CSV: ")
+            csv_file = input("Nombre del archivo (CSV o Parquet): ")
             try:
                 app.load_and_process_data(csv_file)
             except Exception as e:
@@ -273,6 +341,12 @@ def main():
             app.reset_database()
 
         elif choice == "6":
+            try:
+                app.resume_ingestion()
+            except Exception as e:
+                print(f"[KO] Error: {e}")
+
+        elif choice == "7":
             print("¡Hasta luego!")
             break
 
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Importación masiva (no interactiva)
+===================================
+
+Ingesta varios ficheros CSV/Parquet/Arrow en paralelo, sin menú, para
+lanzarla desde cron o CI. Cada fichero se procesa como un trabajo de
+ingesta reanudable (ver `jobs/`) y al final se muestra un resumen por
+fichero: filas/s, filas guardadas, sin cambios y casi duplicados.
+
+Con --dry-run no se llama a la API ni se escribe nada: se estima cuántas
+filas habría que embeber y el coste aproximado.
+
+Uso:
+    python scripts/bulk_import.py data/
+    python scripts/bulk_import.py "exports/*.parquet" data/pisos_example.csv --workers 4
+    python scripts/bulk_import.py data/ --dry-run --model text-embedding-3-small
+"""
+
+import sys
+import os
+import glob
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+# Añadir la raíz del proyecto al path para imports
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.config import Config
+from src.data_processor import DataProcessor
+from src.ingestion import IngestionPipeline
+from src.ingestion_job import IngestionJob
+from cost_calculator import EmbeddingCostCalculator
+
+INPUT_EXTENSIONS = ('.csv',) + tuple(DataProcessor.COLUMNAR_EXTENSIONS)
+
+
+def collect_files(inputs: List[str]) -> List[str]:
+    """Expande directorios y patrones glob a una lista ordenada de ficheros"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item) or [item]
+
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(INPUT_EXTENSIONS):
+                files.append(os.path.abspath(path))
+            elif not os.path.exists(path):
+                print(f" Aviso: no existe {path}")
+
+    return sorted(set(files))
+
+
+def import_file(path: str, chunksize: int, model: str) -> Dict:
+    """Ingesta de un fichero como trabajo reanudable"""
+    job = IngestionJob.create(path, chunksize=chunksize, use_large_model=model == Config.EMBEDDING_MODEL_LARGE)
+    try:
+        return job.run()
+    except Exception as e:
+        print(f" Error importando {path}: {e}")
+        return job.get_status()
+
+
+def estimate_file(path: str, chunksize: int, model: str) -> Dict:
+    """Estimación de filas a embeber y coste, sin API ni escrituras"""
+    estimate = IngestionPipeline(use_large_model=model == Config.EMBEDDING_MODEL_LARGE).estimate(path, chunksize)
+    price = EmbeddingCostCalculator.EMBEDDING_PRICES.get(model, 0)
+    estimate['estimated_cost_usd'] = estimate['estimated_tokens'] / 1_000_000 * price
+    return estimate
+
+
+def print_import_summary(results: Dict[str, Dict], elapsed: float):
+    """Resumen por fichero de una importación"""
+    print(f"\n RESUMEN DE IMPORTACIÓN")
+    print("=" * 100)
+    print(f"{'Fichero':<40} {'Estado':<10} {'Filas':>9} {'Guardadas':>10} {'Sin camb.':>10} "
+          f"{'Duplic.':>8} {'Filas/s':>9}")
+    for path, status in results.items():
+        print(f"{os.path.basename(path)[:40]:<40} {status.get('state', '-'):<10} "
+              f"{status.get('rows_done', 0):>9,} {status.get('rows_written', 0):>10,} "
+              f"{status.get('rows_skipped', 0):>10,} {status.get('rows_near_duplicates', 0):>8,} "
+              f"{status.get('rows_per_second', 0):>9,.0f}")
+
+    total_rows = sum(status.get('rows_done', 0) for status in results.values())
+    print("-" * 100)
+    print(f" Total: {total_rows:,} filas en {elapsed:.1f}s ({total_rows / elapsed if elapsed else 0:,.0f} filas/s)")
+    print(f" Tokens usados (estimados): {sum(status.get('tokens_used', 0) for status in results.values()):,}")
+
+
+def print_estimate_summary(results: Dict[str, Dict], model: str):
+    """Resumen por fichero de un dry-run"""
+    print(f"\n ESTIMACIÓN (dry-run, modelo {model})")
+    print("=" * 100)
+    print(f"{'Fichero':<40} {'Filas':>9} {'A embeber':>10} {'Sin camb.':>10} {'Duplic.':>8} "
+          f"{'Tokens':>12} {'Coste $':>9}")
+    for path, estimate in results.items():
+        print(f"{os.path.basename(path)[:40]:<40} {estimate['rows_read']:>9,} {estimate['rows_to_embed']:>10,} "
+              f"{estimate['rows_skipped']:>10,} {estimate['rows_near_duplicates']:>8,} "
+              f"{estimate['estimated_tokens']:>12,} {estimate['estimated_cost_usd']:>9.4f}")
+
+    print("-" * 100)
+    print(f" Total tokens: {sum(e['estimated_tokens'] for e in results.values()):,}")
+    print(f" Coste total estimado: ${sum(e['estimated_cost_usd'] for e in results.values()):.4f}")
+    print(" (cota superior: no descuenta los textos que ya estén en la caché de embeddings)")
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Importación masiva de ficheros de propiedades")
+    parser.add_argument("inputs", nargs='+', help="Ficheros, directorios o patrones glob (CSV/Parquet/Arrow)")
+    parser.add_argument("--workers", type=int, default=2, help="Ficheros procesados en paralelo")
+    parser.add_argument("--chunksize", type=int, default=Config.INGESTION_CHUNK_SIZE, help="Filas por bloque")
+    parser.add_argument("--embedding-workers", type=int, default=Config.EMBEDDING_MAX_WORKERS,
+                        help="Peticiones de embeddings en vuelo por fichero")
+    parser.add_argument("--processing-workers", type=int, default=Config.PROCESSING_WORKERS,
+                        help="Procesos para textos y metadata (1 = sin pool)")
+    parser.add_argument("--model", default=Config.EMBEDDING_MODEL_LARGE,
+                        choices=[Config.EMBEDDING_MODEL_SMALL, Config.EMBEDDING_MODEL_LARGE],
+                        help="Modelo de embeddings")
+    parser.add_argument("--dry-run", action="store_true", help="Solo estimar filas y coste, sin importar")
+    args = parser.parse_args()
+
+    files = collect_files(args.inputs)
+    if not files:
+        print(" Error: no se encontraron ficheros CSV/Parquet/Arrow")
+        sys.exit(1)
+
+    Config.EMBEDDING_MAX_WORKERS = args.embedding_workers
+    Config.PROCESSING_WORKERS = args.processing_workers
+
+    print(f" Ficheros: {len(files)} ({args.workers} en paralelo)")
+    for path in files:
+        print(f"    - {path}")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        if args.dry_run:
+            futures = {path: executor.submit(estimate_file, path, args.chunksize, args.model) for path in files}
+        else:
+            futures = {path: executor.submit(import_file, path, args.chunksize, args.model) for path in files}
+        results = {path: future.result() for path, future in futures.items()}
+
+    if args.dry_run:
+        print_estimate_summary(results, args.model)
+        return
+
+    print_import_summary(results, time.time() - start)
+    if any(status.get('state') != 'completed' for status in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,10 @@ import pandas as pd
 import argparse
 from typing import Dict, List, Tuple
 
-# Añadir src al path para imports
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+# Añadir la raíz del proyecto al path para imports
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from data_processor import DataProcessor
+from src.data_processor import DataProcessor
 
 class EmbeddingCostCalculator:
     """Calculadora de costos para embeddings OpenAI"""
@@ -49,7 +49,7 @@ class EmbeddingCostCalculator:
 
         # Cargar datos
         try:
-            df = pd.read_csv(csv_path)
+            df = DataProcessor.read_file(csv_path)
             print(f" Archivo cargado: {len(df)} registros")
         except Exception as e:
             print(f" Error cargando archivo: {e}")
@@ -62,7 +62,7 @@ class EmbeddingCostCalculator:
 
         # Generar textos descriptivos como lo hace el sistema real
         print("\n Generando textos descriptivos...")
-        descriptive_texts = df_clean.apply(DataProcessor.build_descriptive_text, axis=1).tolist()
+        descriptive_texts = DataProcessor.build_descriptive_texts(df_clean)
 
         # Analizar estadísticas de texto
         text_stats = self._analyze_text_statistics(descriptive_texts)
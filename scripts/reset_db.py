@@ -27,6 +27,16 @@ def reset_database():
     else:
         print("- No había directorio ChromaDB")
 
+    # Índice cuantizado (solo existe con Config.VECTOR_STORAGE = 'int8' / 'binary')
+    if os.path.exists(Config.QUANTIZED_INDEX_PATH):
+        shutil.rmtree(Config.QUANTIZED_INDEX_PATH)
+        print(f"✓ Directorio '{Config.QUANTIZED_INDEX_PATH}' eliminado")
+
+    # Índice léxico (BM25) de la búsqueda híbrida
+    if os.path.exists(Config.LEXICAL_INDEX_PATH):
+        shutil.rmtree(Config.LEXICAL_INDEX_PATH)
+        print(f"✓ Directorio '{Config.LEXICAL_INDEX_PATH}' eliminado")
+
     print("🆕 Base de datos lista para cargar datos nuevos")
 
 if __name__ == "__main__":
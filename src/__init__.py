@@ -6,6 +6,15 @@ from .embeddings_manager import EmbeddingsManager
 from .database_manager import DatabaseManager
 from .search_engine import PropertySearchEngine
 from .query_enhancer import QueryEnhancer
+from .rate_limiter import RateLimiter
+from .embedding_cache import EmbeddingCache
+from .query_cache import QueryEmbeddingCache
+from .quantized_index import QuantizedIndex
+from .lexical_index import LexicalIndex
+from .ingestion import IngestionPipeline
+from .ingestion_job import IngestionJob
+from .near_duplicates import NearDuplicateDetector
+from .embedding_backends import EmbeddingBackend, OpenAIBackend, LocalHashingBackend, create_backend
 
 __all__ = [
     'Config',
@@ -13,5 +22,17 @@ __all__ = [
     'EmbeddingsManager',
     'DatabaseManager',
     'PropertySearchEngine',
-    'QueryEnhancer'
+    'QueryEnhancer',
+    'RateLimiter',
+    'EmbeddingCache',
+    'QueryEmbeddingCache',
+    'EmbeddingBackend',
+    'OpenAIBackend',
+    'LocalHashingBackend',
+    'create_backend',
+    'QuantizedIndex',
+    'LexicalIndex',
+    'IngestionPipeline',
+    'IngestionJob',
+    'NearDuplicateDetector'
 ]
\ No newline at end of file
@@ -9,13 +9,121 @@ class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     EMBEDDING_MODEL_SMALL = "text-embedding-3-small"
     EMBEDDING_MODEL_LARGE = "text-embedding-3-large"
+
+    # Backend de embeddings: 'openai' (por defecto) o 'local' (CPU, offline, determinista)
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')
+    LOCAL_EMBEDDING_DIM = 768
+    LOCAL_EMBEDDING_NGRAMS = (3, 5)
+
+    # Dimensión de los embeddings guardados (None = nativa: 3072 large / 1536 small).
+    # Con OpenAI se pide al servidor (parámetro 'dimensions'); en local se trunca y renormaliza.
+    # Una colección solo admite una dimensión: cambiarla exige resetear la BD.
+    EMBEDDING_DIMENSIONS = None
+
+    # Almacenamiento de vectores: 'chroma' (HNSW completo en ChromaDB), 'int8' o 'binary'
+    # En modo cuantizado ChromaDB solo guarda documentos y metadata; la búsqueda usa
+    # la copia compacta y re-puntúa los mejores candidatos con los vectores completos.
+    # 'int8' (1 byte por dimensión) solo comprime 4x la copia en RAM frente a float32;
+    # para 8-32x hay que usar 'binary' (1 bit por dimensión, 32x). Los vectores
+    # completos siguen en disco en ambos modos.
+    VECTOR_STORAGE = os.getenv('VECTOR_STORAGE', 'chroma')
+    QUANTIZED_INDEX_PATH = "quantized_index"
+    QUANTIZED_RESCORE_FACTOR = 10  # Candidatos re-puntuados = n_results * factor
+
+    # Multi-vector: cada propiedad se trocea y se guarda un embedding por trozo
+    CHUNKING_ENABLED = False
+    CHUNK_MAX_TOKENS = 256
+    CHUNK_AGGREGATION = "max"      # 'max' (max-sim) o 'sum_top_k'
+    CHUNK_TOP_K = 3                # Trozos sumados por propiedad en 'sum_top_k'
+    CHUNK_OVERFETCH = 4            # Trozos recuperados por cada propiedad pedida
+
+    # Batching de embeddings (textos por llamada y presupuesto estimado de tokens)
+    EMBEDDING_BATCH_SIZE = 256
+    EMBEDDING_BATCH_MAX_TOKENS = 250_000
+    EMBEDDING_CHARS_PER_TOKEN = 3.5  # Estimación para español (ver scripts/cost_calculator.py)
+
+    # Concurrencia y límites de la API de embeddings
+    EMBEDDING_MAX_WORKERS = 4           # Peticiones en vuelo simultáneamente
+    EMBEDDING_RPM_LIMIT = 3000          # Peticiones por minuto
+    EMBEDDING_TPM_LIMIT = 1_000_000     # Tokens por minuto
+    EMBEDDING_MAX_RETRIES = 5           # Reintentos por lote ante 429/5xx
+    EMBEDDING_BACKOFF_BASE = 1.0        # Segundos
+    EMBEDDING_BACKOFF_MAX = 60.0        # Segundos
+
+    # Caché persistente de embeddings (clave: hash de modelo + texto)
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_PATH = "cache/embeddings.sqlite"
+    EMBEDDING_CACHE_MAX_ENTRIES = 500_000
+
+    # Caché LRU/TTL de embeddings de consultas (None en la ruta = solo memoria)
+    QUERY_CACHE_CAPACITY = 1024
+    QUERY_CACHE_TTL_SECONDS = 24 * 3600
+    QUERY_CACHE_DISK_PATH = "cache/query_embeddings.sqlite"
+    QUERY_CACHE_DISK_MAX_ENTRIES = 50_000
     
     # ChromaDB
     CHROMADB_PATH = "chromadb"
     COLLECTION_NAME = "pisos"
+    DB_BATCH_SIZE = 5000       # Registros por collection.add (se acota al máximo del cliente)
+    DB_WRITE_WORKERS = 1       # Lotes enviados en paralelo
+
+    # Limpieza y construcción de textos en paralelo (procesos; 1 = secuencial)
+    PROCESSING_WORKERS = 1
+    PROCESSING_PARTITION_ROWS = 50_000  # Filas por trozo enviado a cada proceso
+    # (en la ingesta por bloques, subir también PIPELINE_PREPARE_WORKERS para
+    # tener varios bloques a la vez en el pool)
+
+    # Casi duplicados (MinHash + LSH) descartados antes de embeber
+    NEAR_DUP_ENABLED = True
+    NEAR_DUP_THRESHOLD = 0.8           # Jaccard estimado mínimo entre textos
+    NEAR_DUP_NUM_PERM = 64             # Permutaciones MinHash
+    NEAR_DUP_BANDS = 16                # Bandas LSH (NUM_PERM / BANDS filas por banda)
+    NEAR_DUP_SHINGLE_SIZE = 3          # Palabras por shingle
+    NEAR_DUP_NUMERIC_TOLERANCE = 0.05  # Diferencia relativa máxima en precio y metros
+    NEAR_DUP_MIN_SHINGLES = 10         # Shingles mínimos fuera del título y la ubicación para comparar
+    NEAR_DUP_MAX_REPRESENTATIVES = 2_000_000  # Anuncios recordados entre bloques (~0,6 KB cada uno)
+
+    # Ingesta en streaming: el CSV se procesa por bloques con memoria acotada
+    STREAMING_INGESTION = False
+    INGESTION_CHUNK_SIZE = 10_000  # Filas por bloque
+    INGESTION_JOBS_PATH = "jobs"   # Logs de checkpoints de los trabajos de ingesta
+
+    # Etapas solapadas en la ingesta (hilos conectados por colas acotadas)
+    PIPELINE_OVERLAP = True
+    PIPELINE_QUEUE_SIZE = 2        # Bloques en espera entre dos etapas
+    PIPELINE_PREPARE_WORKERS = 1   # Hilos por etapa
+    PIPELINE_EMBED_WORKERS = 2
+    PIPELINE_WRITE_WORKERS = 1
     
+    # Filtros estructurados dentro de la consulta vectorial ('where' de ChromaDB),
+    # solo si la selectividad estimada no permite post-filtrar bajo el techo de candidatos
+    FILTER_PUSHDOWN = True
+
+    # Sobre-recuperación adaptativa: si no hay bastantes resultados que cumplan
+    # los filtros, k crece geométricamente hasta el techo antes de relajarlos
+    SEARCH_GROWTH_FACTOR = 4
+    SEARCH_MAX_CANDIDATES = 1000
+    SELECTIVITY_SAMPLE_SIZE = 2000     # Registros de muestra para estimar la selectividad sin pushdown
+
+    # search_many: consultas analizadas por el LLM en paralelo
+    SEARCH_BATCH_WORKERS = 16
+
+    # Búsqueda especulativa (interactiva): la consulta original se embebe y se
+    # recupera mientras el LLM la analiza
+    SPECULATIVE_SEARCH = True
+    SEARCH_LLM_DEADLINE = 3.0           # Segundos; después se usan los resultados de la consulta original
+    SPECULATIVE_REUSE_OVERLAP = 0.8     # Fracción de palabras originales en la query semántica para reutilizar
+
+    # Búsqueda híbrida: índice léxico BM25 (se construye en la ingesta) fusionado
+    # con los resultados vectoriales por reciprocal rank fusion
+    HYBRID_SEARCH = True
+    LEXICAL_INDEX_PATH = "lexical_index"
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    RRF_K = 60                          # Constante de RRF: 1 / (RRF_K + posición)
+
     # App
     MAX_RESULTS = 10
     DEFAULT_RESULTS = 3
 
-    
\ No newline at end of file
+    
@@ -1,6 +1,14 @@
+import hashlib
+import json
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 
+from .config import Config
+
 class DataProcessor:
 
     # Definir columnas de texto descriptivo vs estructuradas
@@ -14,31 +22,235 @@ class DataProcessor:
         'Ascensor', 'Exterior', 'Trastero', 'Amueblado'
     ]
 
+    # Categóricos de texto: se leen directamente como 'category'
+    READ_CATEGORY_COLUMNS = ['tipo', 'barrio', 'distrito', 'localidad', 'provincia']
+
+    # Numéricos que, ya limpios, son enteros pequeños (Habitaciones/Baños caben en int8)
+    INTEGER_COLUMNS = ['Habitaciones', 'Baños', 'postal_code']
+
+    # Valor de relleno de los categóricos vacíos
+    MISSING_CATEGORY = 'No especificado'
+
+    # Otras fuentes: cómo llevar sus columnas al esquema de pisos.com
+    SOURCE_SCHEMAS = {
+        'habitaclia': {
+            # Columnas que identifican la fuente
+            'signature': ['city_name', 'title', 'area_m2'],
+            'rename': {
+                'title': 'titulo',
+                'price': 'precio',
+                'rooms': 'Habitaciones',
+                'bathrooms': 'Baños',
+                'area_m2': 'metros',
+                'url': 'url_inmueble',
+                'city_name': 'localidad',
+                'image_urls': 'imagenes',
+            },
+            # Columnas derivadas de otra ya renombrada
+            'copy': {'provincia': 'localidad'},
+            # Columna "Barrio- \n      Calle" que se separa en barrio y dirección
+            'location': 'location',
+            # La URL lleva la posición en el listado (?pag=7&...&lo=55): sin quitarla, el
+            # mismo anuncio cambiaría de id (y se duplicaría) entre dos scrapes
+            'strip_url_query': True,
+            # Tipo de inmueble según la primera palabra del título
+            'type_from_title': {
+                'Flat': 'Piso',
+                'Apartment': 'Apartamento',
+                'Penthouse': 'Ático',
+                'House': 'Casa',
+                'Semi': 'Casa adosada',
+                'Country': 'Casa rural',
+                'Chalet': 'Chalet',
+                'Duplex': 'Dúplex',
+                'Loft': 'Loft',
+                'Ground': 'Bajo',
+            },
+            # Sin precio son páginas de listado del portal, no anuncios
+            'required': ['precio'],
+        },
+    }
+
+    # Formatos de entrada admitidos (por extensión)
+    COLUMNAR_EXTENSIONS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+    # Fuente de un DataFrame según sus columnas ('pisos' = esquema nativo)
+    @staticmethod
+    def detect_source(df):
+        for name, schema in DataProcessor.SOURCE_SCHEMAS.items():
+            if all(col in df.columns for col in schema['signature']):
+                return name
+        return 'pisos'
+
+    # Llevar un DataFrame de otra fuente al esquema de pisos.com (vectorizado)
+    @staticmethod
+    def normalize_schema(df, source=None):
+        source = source or DataProcessor.detect_source(df)
+        if source == 'pisos':
+            return df
+
+        schema = DataProcessor.SOURCE_SCHEMAS[source]
+        df = df.rename(columns=schema['rename'])
+
+        location = schema.get('location')
+        if location and location in df.columns:
+            raw = df[location]
+            df['barrio'] = raw.str.split(r'-\s*\n', n=1, regex=True).str[0].str.strip()
+            df['direccion'] = (
+                raw.str.replace(r'-\s*\n\s*', ', ', regex=True)
+                   .str.replace(r'\s+', ' ', regex=True)
+                   .str.strip()
+            )
+            df = df.drop(columns=[location])
+
+        if schema.get('strip_url_query') and 'url_inmueble' in df.columns:
+            df['url_inmueble'] = df['url_inmueble'].str.split('?', n=1).str[0]
+
+        for target, source_col in schema.get('copy', {}).items():
+            if source_col in df.columns:
+                df[target] = df[source_col]
+
+        type_map = schema.get('type_from_title')
+        if type_map and 'titulo' in df.columns:
+            first_word = df['titulo'].str.extract(r'^\s*(\w+)', expand=False)
+            df['tipo'] = first_word.map(type_map)
+
+        required = [col for col in schema.get('required', []) if col in df.columns]
+        if required:
+            df = df.dropna(subset=required)
+
+        return df
+
+    @staticmethod
+    def _input_format(source):
+        name = str(getattr(source, 'name', source)).lower()
+        for extension, file_format in DataProcessor.COLUMNAR_EXTENSIONS.items():
+            if name.endswith(extension):
+                return file_format
+        return 'csv'
+
+    # Tipos compactos para la lectura (solo columnas presentes)
+    @staticmethod
+    def read_dtypes(columns=None):
+        return {
+            col: 'category' for col in DataProcessor.READ_CATEGORY_COLUMNS
+            if columns is None or col in columns
+        }
+
+    @staticmethod
+    def _apply_read_dtypes(df):
+        dtypes = DataProcessor.read_dtypes(df.columns)
+        return df.astype(dtypes) if dtypes else df
+
+    # Leer un fichero completo (CSV, Parquet o Arrow/Feather)
+    @staticmethod
+    def read_file(source):
+        file_format = DataProcessor._input_format(source)
+        if file_format == 'parquet':
+            return DataProcessor._apply_read_dtypes(pd.read_parquet(source))
+        if file_format == 'feather':
+            return DataProcessor._apply_read_dtypes(pd.read_feather(source))
+        return pd.read_csv(source, dtype=DataProcessor.read_dtypes())
+
+    # Leer un fichero por bloques de `chunksize` filas
+    @staticmethod
+    def iter_file_chunks(source, chunksize):
+        """
+        CSV con el lector por bloques de pandas; Parquet por lotes de pyarrow
+        (sin cargar el fichero entero ni parsear texto). Arrow/Feather se lee
+        entero (ya es columnar en memoria) y se trocea.
+        """
+        file_format = DataProcessor._input_format(source)
+
+        if file_format == 'csv':
+            yield from pd.read_csv(source, chunksize=chunksize, dtype=DataProcessor.read_dtypes())
+            return
+
+        if file_format == 'feather':
+            df = DataProcessor._apply_read_dtypes(pd.read_feather(source))
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+            return
+
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Para leer ficheros Parquet hace falta pyarrow (pip install pyarrow)")
+
+        for record_batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield DataProcessor._apply_read_dtypes(record_batch.to_pandas())
+
+    # Nº de filas de un fichero sin cargarlo entero
+    @staticmethod
+    def count_rows(source):
+        file_format = DataProcessor._input_format(source)
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(source).metadata.num_rows
+        if file_format == 'feather':
+            return len(pd.read_feather(source, columns=[]))
+
+        # Con el parser de CSV (por bloques, solo la primera columna): contar saltos de
+        # línea sobreestima con campos multilínea entre comillas ('location' de habitaclia)
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        try:
+            reader = pa_csv.open_csv(
+                source,
+                read_options=pa_csv.ReadOptions(skip_rows=1, autogenerate_column_names=True),
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                convert_options=pa_csv.ConvertOptions(include_columns=['f0'], column_types={'f0': pa.string()})
+            )
+        except pa.ArrowInvalid:
+            # Fichero vacío o solo con la cabecera
+            return 0
+        return sum(batch.num_rows for batch in reader)
+
     # Limpieza rápida de datos
     @staticmethod
-    def clean_dataframe(df):
-        df_clean = df.copy()
+    def clean_dataframe(df, verbose=True):
+        """
+        Los categóricos quedan como 'category' y los enteros (Habitaciones,
+        Baños, código postal) en el entero más pequeño que los contiene.
+        No hace falta copiar el DataFrame de entrada: dropna ya devuelve uno
+        nuevo y el original no se modifica.
+        """
+        # Otras fuentes (p. ej. habitaclia) se llevan antes al esquema de pisos.com
+        df_clean = DataProcessor.normalize_schema(df)
 
-        print(f"- Datos originales: {len(df)}")
+        if verbose:
+            print(f"- Datos originales: {len(df)}")
 
         # Columnas críticas para mantener el registro
         critical_columns = ['titulo']
         df_clean = df_clean.dropna(subset=critical_columns)
 
-        # Limpiar datos nulos en columnas de texto
-        for col in DataProcessor.TEXT_COLUMNS:
-            if col in df_clean.columns:
-                df_clean[col] = df_clean[col].fillna('')
+        columns = set(df_clean.columns)
+        text_columns = [col for col in DataProcessor.TEXT_COLUMNS if col in columns]
+        numerical_columns = [col for col in DataProcessor.NUMERICAL_COLUMNS if col in columns]
+        categorical_columns = [col for col in DataProcessor.CATEGORICAL_COLUMNS if col in columns]
 
-        # Limpiar datos nulos en columnas numéricas
-        for col in DataProcessor.NUMERICAL_COLUMNS:
-            if col in df_clean.columns:
-                df_clean[col] = pd.to_numeric(df_clean[col], errors='coerce').fillna(0)
+        # El valor de relleno tiene que existir como categoría en los ya categóricos
+        for col in categorical_columns:
+            if isinstance(df_clean[col].dtype, pd.CategoricalDtype) and \
+                    DataProcessor.MISSING_CATEGORY not in df_clean[col].cat.categories:
+                df_clean[col] = df_clean[col].cat.add_categories(DataProcessor.MISSING_CATEGORY)
 
-        # Limpiar datos nulos en columnas categóricas
-        for col in DataProcessor.CATEGORICAL_COLUMNS:
-            if col in df_clean.columns:
-                df_clean[col] = df_clean[col].fillna('No especificado')
+        # Nulos de texto y categóricos en una sola pasada
+        fills = {col: '' for col in text_columns}
+        fills.update({col: DataProcessor.MISSING_CATEGORY for col in categorical_columns})
+        if fills:
+            df_clean = df_clean.fillna(fills)
+
+        # Numéricos: coerción, nulos a 0 y enteros pequeños donde se pueda
+        for col in numerical_columns:
+            values = pd.to_numeric(df_clean[col], errors='coerce').fillna(0)
+            if col in DataProcessor.INTEGER_COLUMNS:
+                values = pd.to_numeric(values, downcast='integer')
+            df_clean[col] = values
+
+        if categorical_columns:
+            df_clean[categorical_columns] = df_clean[categorical_columns].astype('category')
 
         # Eliminar duplicados por URL
         if 'url_inmueble' in df_clean.columns:
@@ -46,8 +258,9 @@ class DataProcessor:
         else:
             df_clean = df_clean.drop_duplicates()
 
-        print(f"- Datos después de limpieza: {len(df_clean)}")
-        print(f"- Registros eliminados: {len(df) - len(df_clean)}")
+        if verbose:
+            print(f"- Datos después de limpieza: {len(df_clean)}")
+            print(f"- Registros eliminados: {len(df) - len(df_clean)}")
 
         return df_clean
 
@@ -90,6 +303,73 @@ class DataProcessor:
 
         return "\n".join(text_parts)
 
+    # Partir un texto en trozos de como mucho `max_chars` caracteres, por frases
+    @staticmethod
+    def _split_text(text, max_chars, joiner=" "):
+        # Cada frase se mide una sola vez; el empaquetado solo suma longitudes
+        sentences = [s for s in re.split(r'(?<=[.!?;])\s+|\n+', text) if s.strip()]
+
+        chunks, current, current_len = [], [], 0
+        for sentence in sentences:
+            # Frases más largas que el límite: corte duro por caracteres
+            while len(sentence) > max_chars:
+                if current:
+                    chunks.append(joiner.join(current))
+                    current, current_len = [], 0
+                cut = sentence.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                chunks.append(sentence[:cut])
+                sentence = sentence[cut:].strip()
+
+            if not sentence:
+                continue
+            if current and current_len + len(sentence) + 1 > max_chars:
+                chunks.append(joiner.join(current))
+                current, current_len = [], 0
+            current.append(sentence)
+            current_len += len(sentence) + 1
+
+        if current:
+            chunks.append(joiner.join(current))
+        return chunks
+
+    # Crear trozos (chunks) de texto acotados en tokens para embeddings multi-vector
+    @staticmethod
+    def build_text_chunks(row, max_tokens=None):
+        """
+        Divide el texto descriptivo de una propiedad en trozos acotados en tokens.
+        El trozo 0 agrupa los campos cortos (título, dirección, características,
+        keywords); la descripción se reparte en trozos por frases, cada uno
+        precedido del título para no perder el contexto.
+        """
+        max_tokens = max_tokens or Config.CHUNK_MAX_TOKENS
+        max_chars = int(max_tokens * Config.EMBEDDING_CHARS_PER_TOKEN)
+
+        def field(col):
+            value = row.get(col)
+            return str(value) if pd.notna(value) and str(value) != '' else None
+
+        header_fields = [
+            ('titulo', 'Propiedad'),
+            ('direccion', 'Ubicación'),
+            ('caract', 'Características'),
+            ('caract_extra', 'Extras'),
+            ('descrip_keywords', 'Palabras clave'),
+        ]
+        header_parts = [f"{label}: {field(col)}" for col, label in header_fields if field(col)]
+        header = "\n".join(header_parts) if header_parts else "Propiedad inmobiliaria"
+
+        chunks = DataProcessor._split_text(header, max_chars, joiner="\n") if len(header) > max_chars else [header]
+
+        descripcion = field('descrip')
+        if descripcion:
+            prefix = f"Propiedad: {field('titulo')}\n" if field('titulo') else ""
+            body_chars = max(max_chars - len(prefix) - len("Descripción: "), 1)
+            for part in DataProcessor._split_text(descripcion, body_chars):
+                chunks.append(f"{prefix}Descripción: {part}")
+
+        return chunks
+
     # Crear metadata estructurada para filtros y scoring
     @staticmethod
     def build_structured_metadata(row):
@@ -130,3 +410,194 @@ class DataProcessor:
 
         return metadata
 
+
+    # Etiquetas de cada columna de texto, en el orden de build_descriptive_text
+    TEXT_LABELS = [
+        ('titulo', 'Propiedad'),
+        ('direccion', 'Ubicación'),
+        ('caract', 'Características'),
+        ('caract_extra', 'Extras'),
+        ('descrip', 'Descripción'),
+        ('descrip_keywords', 'Palabras clave'),
+    ]
+
+    # Valores categóricos que se consideran vacíos
+    EMPTY_CATEGORICAL_VALUES = ['No especificado', 'nan', '', 'None']
+
+    # Versión vectorizada de build_descriptive_text para todo el DataFrame
+    @staticmethod
+    def build_descriptive_texts(df):
+        """
+        Mismo resultado que df.apply(build_descriptive_text, axis=1).tolist(),
+        pero concatenando columnas enteras en lugar de recorrer filas.
+        """
+        if len(df) == 0:
+            return []
+
+        combined = pd.Series('', index=df.index, dtype=object)
+        for col, label in DataProcessor.TEXT_LABELS:
+            if col not in df.columns:
+                continue
+            values = df[col]
+            as_text = values.astype(str)
+            valid = values.notna() & (as_text != '')
+            # Cada parte lleva su '\n' delante; el primero se quita al final
+            combined = combined + ("\n" + label + ": " + as_text).where(valid, '')
+
+        texts = combined.str[1:]
+        texts = texts.where(combined != '', "Propiedad inmobiliaria")
+        return texts.tolist()
+
+    # Versión vectorizada de build_structured_metadata para todo el DataFrame
+    @staticmethod
+    def build_structured_metadatas(df):
+        """
+        Mismo resultado que df.apply(build_structured_metadata, axis=1).tolist().
+        Las máscaras de validez se calculan por columna y la completitud es la
+        suma por filas de una matriz booleana; solo el montaje final de los
+        diccionarios recorre las filas.
+        """
+        n_rows = len(df)
+        if n_rows == 0:
+            return []
+
+        columns = []  # (nombre, valores, máscara de validez)
+
+        for col in DataProcessor.NUMERICAL_COLUMNS:
+            if col not in df.columns:
+                continue
+            values = df[col].to_numpy(dtype=object)
+            valid = df[col].notna().to_numpy() & (values != 0)
+            columns.append((col, values, valid, float))
+
+        for col in DataProcessor.CATEGORICAL_COLUMNS:
+            if col not in df.columns:
+                continue
+            as_text = df[col].astype(str)
+            valid = (df[col].notna() & ~as_text.isin(DataProcessor.EMPTY_CATEGORICAL_VALUES)).to_numpy()
+            columns.append((col, as_text.to_numpy(dtype=object), valid, None))
+
+        if 'url_inmueble' in df.columns:
+            as_text = df['url_inmueble'].astype(str)
+            valid = df['url_inmueble'].notna().to_numpy()
+            columns.append(('url', as_text.to_numpy(dtype=object), valid, None))
+
+        metadatas = [{} for _ in range(n_rows)]
+        for name, values, valid, convert in columns:
+            for i in np.flatnonzero(valid):
+                metadatas[i][name] = convert(values[i]) if convert else values[i]
+
+        # Precio por m² (solo si hay precio y metros distintos de 0)
+        filled = np.zeros(n_rows, dtype=np.int64)
+        for name, values, valid, convert in columns:
+            # Un texto vacío no cuenta para la completitud (y luego se descarta)
+            filled += valid & (values != '') if convert is None else valid
+
+        for i, metadata in enumerate(metadatas):
+            if metadata.get('precio') and metadata.get('metros'):
+                metadata['precio_por_m2'] = round(metadata['precio'] / metadata['metros'], 2)
+                filled[i] += 1
+
+        total_fields = len(DataProcessor.NUMERICAL_COLUMNS) + len(DataProcessor.CATEGORICAL_COLUMNS)
+        for i, metadata in enumerate(metadatas):
+            metadata['completeness_score'] = round(int(filled[i]) / total_fields, 2)
+            if metadata.get('url') == '':
+                del metadata['url']
+
+        return metadatas
+
+    # Textos descriptivos y metadata de un DataFrame ya limpio
+    @staticmethod
+    def build_texts_and_metadatas(df):
+        return DataProcessor.build_descriptive_texts(df), DataProcessor.build_structured_metadatas(df)
+
+    # Trabajo de cada proceso: limpiar un trozo y construir sus textos y metadata
+    @staticmethod
+    def _process_partition(df):
+        df_clean = DataProcessor.clean_dataframe(df, verbose=False)
+        # El índice del trozo limpio son las posiciones conservadas en el original
+        return (df_clean,) + DataProcessor.build_texts_and_metadatas(df_clean)
+
+    # Pool de procesos para limpieza y construcción de textos
+    @staticmethod
+    def create_process_pool(workers=None):
+        # 'spawn': los hijos no heredan hilos ni conexiones abiertas del proceso padre
+        return ProcessPoolExecutor(
+            max_workers=workers or Config.PROCESSING_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    # Limpieza + textos + metadata, repartidos entre varios procesos si se pide
+    @staticmethod
+    def process_dataframe(df, workers=None, partition_rows=None):
+        """
+        Devuelve (df limpio, textos descriptivos, metadata estructurada).
+        Con `workers` > 1 el DataFrame se parte en trozos contiguos que se
+        limpian y procesan en un pool de procesos (a cada uno solo se le
+        envían las columnas que usa). Cada proceso devuelve su trozo limpio;
+        en el padre solo se quitan las URLs repetidas entre trozos (se queda
+        la primera), así que el resultado es el mismo que en secuencial.
+        """
+        workers = workers or Config.PROCESSING_WORKERS
+        partition_rows = partition_rows or Config.PROCESSING_PARTITION_ROWS
+
+        if workers <= 1 or len(df) <= partition_rows:
+            df_clean = DataProcessor.clean_dataframe(df)
+            return (df_clean,) + DataProcessor.build_texts_and_metadatas(df_clean)
+
+        df = DataProcessor.normalize_schema(df)
+        if 'url_inmueble' in df.columns:
+            used = DataProcessor.TEXT_COLUMNS + DataProcessor.NUMERICAL_COLUMNS + DataProcessor.CATEGORICAL_COLUMNS
+            columns = [col for col in df.columns if col in used or col == 'url_inmueble']
+        else:
+            # Sin URL se deduplica por fila completa: hacen falta todas las columnas
+            columns = list(df.columns)
+
+        # Índice posicional: identifica cada fila aunque el original tenga etiquetas repetidas
+        positional = df[columns].set_axis(np.arange(len(df)))
+        partitions = [positional.iloc[start:start + partition_rows] for start in range(0, len(df), partition_rows)]
+
+        print(f"- Procesando {len(df)} filas en {len(partitions)} trozos con {workers} procesos")
+        with DataProcessor.create_process_pool(workers) as executor:
+            results = list(executor.map(DataProcessor._process_partition, partitions))
+
+        df_clean = pd.concat([result[0] for result in results])
+        texts = [text for result in results for text in result[1]]
+        metadatas = [metadata for result in results for metadata in result[2]]
+
+        # Los trozos ya vienen limpios: solo faltan los duplicados entre trozos
+        if 'url_inmueble' in df_clean.columns:
+            duplicated = df_clean['url_inmueble'].duplicated().to_numpy()
+        else:
+            duplicated = df_clean.duplicated().to_numpy()
+        if duplicated.any():
+            keep = np.flatnonzero(~duplicated)
+            df_clean = df_clean.iloc[keep]
+            texts = [texts[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+
+        # concat deja como 'object' los categóricos con categorías distintas por trozo
+        categorical_columns = [col for col in DataProcessor.CATEGORICAL_COLUMNS if col in df_clean.columns]
+        if categorical_columns:
+            df_clean[categorical_columns] = df_clean[categorical_columns].astype('category')
+
+        print(f"- Datos originales: {len(df)}")
+        print(f"- Datos después de limpieza: {len(df_clean)}")
+        print(f"- Registros eliminados: {len(df) - len(df_clean)}")
+        return df_clean.set_axis(df.index[df_clean.index.to_numpy()]), texts, metadatas
+
+    # Id estable de una propiedad: derivado de su URL (o del texto si no tiene)
+    @staticmethod
+    def build_property_id(metadata, text):
+        key = metadata.get('url') or text
+        return "piso_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+    # Hash del contenido (texto + metadata) para detectar filas sin cambios
+    @staticmethod
+    def build_content_hash(text, metadata):
+        payload = json.dumps(
+            {'text': text, 'metadata': {k: v for k, v in metadata.items() if k != 'content_hash'}},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
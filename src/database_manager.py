@@ -1,42 +1,460 @@
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import chromadb
 from .config import Config
+from .data_processor import DataProcessor
+from .quantized_index import QuantizedIndex
+from .lexical_index import LexicalIndex
 from tqdm import tqdm
 import pandas as pd
 
 class DatabaseManager:
-    
-    def __init__(self):
-        self.client = chromadb.PersistentClient(path=Config.CHROMADB_PATH)
+
+    # Un cliente y un índice cuantizado/léxico por ruta y proceso: varias
+    # instancias (p. ej. ingestas en paralelo) comparten los mismos ficheros
+    _shared_lock = threading.Lock()
+    _clients = {}
+    _quantized_indexes = {}
+    _lexical_indexes = {}
+    _metadata_samples = {}
+
+    def __init__(self, read_only=False):
+        # Solo lectura (p. ej. estimaciones): no crea la bbdd, la colección ni los índices
+        self.read_only = read_only
+
+        with DatabaseManager._shared_lock:
+            self.client = None
+            if Config.CHROMADB_PATH in DatabaseManager._clients:
+                self.client = DatabaseManager._clients[Config.CHROMADB_PATH]
+            elif not read_only or os.path.isdir(Config.CHROMADB_PATH):
+                DatabaseManager._clients[Config.CHROMADB_PATH] = chromadb.PersistentClient(path=Config.CHROMADB_PATH)
+                self.client = DatabaseManager._clients[Config.CHROMADB_PATH]
+
+            self.quantized_index = None
+            if Config.VECTOR_STORAGE != 'chroma' and not read_only:
+                key = (Config.QUANTIZED_INDEX_PATH, Config.VECTOR_STORAGE)
+                if key not in DatabaseManager._quantized_indexes:
+                    DatabaseManager._quantized_indexes[key] = QuantizedIndex()
+                self.quantized_index = DatabaseManager._quantized_indexes[key]
+
+            self.lexical_index = None
+            if Config.HYBRID_SEARCH and not read_only:
+                if Config.LEXICAL_INDEX_PATH not in DatabaseManager._lexical_indexes:
+                    DatabaseManager._lexical_indexes[Config.LEXICAL_INDEX_PATH] = LexicalIndex()
+                self.lexical_index = DatabaseManager._lexical_indexes[Config.LEXICAL_INDEX_PATH]
+
         self.collection = None
     
     # Creamos la coleccion de chromaDB
     def get_or_create_collection(self):
-        try:
-            self.collection = self.client.get_collection(Config.COLLECTION_NAME)
-            print(f"Colección '{Config.COLLECTION_NAME}' cargada.")
-        except:
-            self.collection = self.client.create_collection(Config.COLLECTION_NAME)
-            print(f"Colección '{Config.COLLECTION_NAME}' creada.")
+        with DatabaseManager._shared_lock:
+            try:
+                self.collection = self.client.get_collection(Config.COLLECTION_NAME)
+                print(f"Colección '{Config.COLLECTION_NAME}' cargada.")
+            except:
+                self.collection = self.client.create_collection(Config.COLLECTION_NAME)
+                print(f"Colección '{Config.COLLECTION_NAME}' creada.")
         
         return self.collection
     
-    # Añadimos propiedades a la bbdd con metadata estructurada
-    def add_properties_to_db(self, df, descriptive_texts, embeddings, structured_metadata):
+    # Dimensión de los embeddings guardados (metadata de la colección o primer vector)
+    def get_embedding_dimensions(self):
+        if self.quantized_index:
+            return self.quantized_index.dim
+
         if not self.collection:
             self.get_or_create_collection()
 
-        print("Agregando propiedades a la base de datos...")
+        metadata = self.collection.metadata or {}
+        if 'embedding_dimensions' in metadata:
+            return metadata['embedding_dimensions']
 
-        for i, (idx, row) in enumerate(tqdm(df.iterrows(), total=len(df), desc="Guardando")):
-            self.collection.add(
-                ids=[f"piso_{i}"],
-                embeddings=[embeddings[i]],
-                documents=[descriptive_texts[i]],  # Solo texto descriptivo
-                metadatas=[structured_metadata[i]]  # Metadata estructurada completa
+        if self.collection.count() == 0:
+            return None
+
+        sample = self.collection.get(limit=1, include=['embeddings'])
+        return len(sample['embeddings'][0])
+
+    # Evita mezclar dimensiones distintas en una misma colección
+    def check_embedding_dimensions(self, dimensions):
+        stored = self.get_embedding_dimensions()
+
+        if stored is not None and stored != dimensions:
+            raise ValueError(
+                f"La colección '{Config.COLLECTION_NAME}' guarda embeddings de {stored} dimensiones "
+                f"y se han recibido de {dimensions}. Revisa Config.EMBEDDING_DIMENSIONS o resetea la BD."
+            )
+
+        # Registrar la dimensión en la colección para no volver a inferirla
+        if self.quantized_index:
+            return
+        metadata = dict(self.collection.metadata or {})
+        if 'embedding_dimensions' not in metadata:
+            metadata['embedding_dimensions'] = stored or dimensions
+            self.collection.modify(metadata=metadata)
+
+    # Tamaño de lote efectivo: el configurado, acotado por el máximo del cliente
+    def _effective_batch_size(self, batch_size=None):
+        batch_size = batch_size or Config.DB_BATCH_SIZE
+        try:
+            return max(1, min(batch_size, self.client.get_max_batch_size()))
+        except Exception:
+            return batch_size
+
+    # Escritura (upsert) por lotes, opcionalmente en paralelo, de registros ya preparados
+    def _add_in_batches(self, ids, embeddings, documents, metadatas, batch_size=None, max_workers=None):
+        batch_size = self._effective_batch_size(batch_size)
+        max_workers = max_workers or Config.DB_WRITE_WORKERS
+        starts = range(0, len(ids), batch_size)
+
+        def write(start):
+            batch_ids = ids[start:start + batch_size]
+            self.collection.upsert(
+                ids=batch_ids,
+                embeddings=embeddings[start:start + batch_size],
+                documents=documents[start:start + batch_size],
+                metadatas=metadatas[start:start + batch_size]
             )
+            return len(batch_ids)
+
+        with tqdm(total=len(ids), desc="Guardando") as pbar:
+            if max_workers <= 1:
+                for start in starts:
+                    pbar.update(write(start))
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for written in executor.map(write, starts):
+                        pbar.update(written)
+
+    # Hashes de contenido ya guardados para esos ids ({id: hash})
+    def get_stored_hashes(self, ids):
+        if not self.collection:
+            if self.read_only:
+                # Sin bbdd o sin colección todavía no hay nada guardado
+                if self.client is None:
+                    return {}
+                try:
+                    self.collection = self.client.get_collection(Config.COLLECTION_NAME)
+                except Exception:
+                    return {}
+            else:
+                self.get_or_create_collection()
+
+        stored = {}
+        batch_size = self._effective_batch_size()
+        for start in range(0, len(ids), batch_size):
+            records = self.collection.get(ids=ids[start:start + batch_size], include=["metadatas"])
+            for id_, meta in zip(records['ids'], records['metadatas']):
+                if Config.CHUNKING_ENABLED and meta and 'property_id' in meta:
+                    id_ = meta['property_id']
+                stored[id_] = (meta or {}).get('content_hash')
+        return stored
+
+    # Posiciones de las propiedades nuevas o modificadas (las demás se omiten)
+    def get_changed_indices(self, descriptive_texts, structured_metadata):
+        """
+        Compara el hash de contenido de cada fila con el guardado bajo su id
+        estable. Devuelve las posiciones que hay que embeber y escribir; las
+        filas idénticas y los ids repetidos dentro del lote se descartan.
+        """
+        ids = [DataProcessor.build_property_id(meta, text)
+               for text, meta in zip(descriptive_texts, structured_metadata)]
+        hashes = [DataProcessor.build_content_hash(text, meta)
+                  for text, meta in zip(descriptive_texts, structured_metadata)]
+
+        lookup_ids = [f"{id_}#c0" for id_ in ids] if Config.CHUNKING_ENABLED else ids
+        stored = self.get_stored_hashes(lookup_ids)
+
+        changed, seen = [], set()
+        for i, (id_, content_hash) in enumerate(zip(ids, hashes)):
+            if id_ in seen:
+                continue
+            seen.add(id_)
+            if stored.get(id_) != content_hash:
+                changed.append(i)
+        return changed
+
+    # Ids estables y metadata con hash de contenido, listos para el upsert
+    @staticmethod
+    def _prepare_records(descriptive_texts, structured_metadata):
+        ids, metadatas = [], []
+        for text, meta in zip(descriptive_texts, structured_metadata):
+            ids.append(DataProcessor.build_property_id(meta, text))
+            metadatas.append({**meta, 'content_hash': DataProcessor.build_content_hash(text, meta)})
+        return ids, metadatas
+
+    # Añadimos (o actualizamos) propiedades en la bbdd con metadata estructurada
+    def add_properties_to_db(self, df, descriptive_texts, embeddings, structured_metadata,
+                             batch_size=None, max_workers=None):
+        """
+        Guarda las propiedades en lotes de hasta `batch_size` registros.
+        `df` es opcional (puede ser None): solo se usan los textos, los
+        embeddings (lista de listas o matriz NumPy) y la metadata.
+        Los ids son estables (derivados de la URL) y se hace upsert, así que
+        volver a cargar un CSV actualiza en lugar de duplicar.
+        """
+        if not self.collection:
+            self.get_or_create_collection()
+
+        n_properties = len(descriptive_texts)
+        if n_properties > 0:
+            self.check_embedding_dimensions(len(embeddings[0]))
+
+        print("Agregando propiedades a la base de datos...")
+
+        ids, metadatas = self._prepare_records(descriptive_texts, structured_metadata)
+        if self.quantized_index:
+            # Los vectores van al índice cuantizado; ChromaDB recibe un marcador de 1 dimensión
+            self.quantized_index.add(ids, embeddings)
+            embeddings = [[float(self.quantized_index.id_to_row[id_])] for id_ in ids]
+
+        self._add_in_batches(
+            ids,
+            embeddings,
+            list(descriptive_texts),      # Solo texto descriptivo
+            metadatas,                    # Metadata estructurada completa + hash
+            batch_size=batch_size,
+            max_workers=max_workers
+        )
+
+        if self.lexical_index:
+            self.lexical_index.add(ids, descriptive_texts)
+        self._invalidate_sample()
 
         print("Base de datos actualizada correctamente.")
 
+    # Añadimos (o actualizamos) propiedades troceadas (un embedding por trozo)
+    def add_property_chunks_to_db(self, chunks_per_property, embeddings, structured_metadata,
+                                  descriptive_texts, batch_size=None, max_workers=None):
+        """
+        `chunks_per_property[i]` son los trozos de la propiedad i y `embeddings`
+        es la lista plana de sus embeddings en el mismo orden. Cada trozo se
+        guarda con id '<propiedad>#c<n>' y la metadata de su propiedad.
+        Los trozos anteriores de esas propiedades se borran antes de escribir.
+        """
+        if not self.collection:
+            self.get_or_create_collection()
+
+        if len(embeddings) > 0:
+            self.check_embedding_dimensions(len(embeddings[0]))
+
+        print("Agregando trozos de propiedades a la base de datos...")
+
+        property_ids, property_metadatas = self._prepare_records(descriptive_texts, structured_metadata)
+
+        chunk_ids, documents, metadatas = [], [], []
+        for property_id, meta, chunks in zip(property_ids, property_metadatas, chunks_per_property):
+            for j, chunk in enumerate(chunks):
+                chunk_ids.append(f"{property_id}#c{j}")
+                documents.append(chunk)
+                metadatas.append({**meta, 'property_id': property_id, 'chunk_index': j})
+
+        # Una propiedad modificada puede tener menos trozos que antes
+        new_ids = set(chunk_ids)
+        stale_ids = []
+        batch_size_ids = self._effective_batch_size()
+        for start in range(0, len(property_ids), batch_size_ids):
+            where = {'property_id': {'$in': property_ids[start:start + batch_size_ids]}}
+            if self.quantized_index:
+                stale_ids.extend(id_ for id_ in self.collection.get(where=where, include=[])['ids'] if id_ not in new_ids)
+            self.collection.delete(where=where)
+
+        # Los trozos que sobran también salen del índice cuantizado (si no, ocuparían puestos del top-k)
+        if stale_ids:
+            self.quantized_index.remove(stale_ids)
+
+        if self.quantized_index:
+            self.quantized_index.add(chunk_ids, embeddings)
+            embeddings = [[float(self.quantized_index.id_to_row[chunk_id])] for chunk_id in chunk_ids]
+
+        self._add_in_batches(chunk_ids, embeddings, documents, metadatas,
+                             batch_size=batch_size, max_workers=max_workers)
+
+        # El índice léxico guarda el texto completo de cada propiedad
+        if self.lexical_index:
+            self.lexical_index.add(property_ids, descriptive_texts)
+        self._invalidate_sample()
+
+        print("Base de datos actualizada correctamente.")
+
+    # Texto completo de varias propiedades a partir de sus trozos guardados
+    def get_property_documents(self, property_ids):
+        if not self.collection:
+            self.get_or_create_collection()
+
+        if not property_ids:
+            return {}
+
+        records = self.collection.get(
+            where={'property_id': {'$in': list(property_ids)}},
+            include=["documents", "metadatas"]
+        )
+
+        chunks = {}
+        for doc, meta in zip(records['documents'], records['metadatas']):
+            chunks.setdefault(meta['property_id'], []).append((meta.get('chunk_index', 0), doc))
+
+        # Trozos de cabecera tal cual + todas las partes de la descripción en orden
+        documents = {}
+        for property_id, parts in chunks.items():
+            header_lines, descripcion = [], []
+            for _, doc in sorted(parts):
+                if doc.startswith("Descripción: ") or "\nDescripción: " in doc:
+                    descripcion.append(doc.split("Descripción: ", 1)[1])
+                else:
+                    header_lines.append(doc)
+            if descripcion:
+                header_lines.append("Descripción: " + " ".join(descripcion))
+            documents[property_id] = "\n".join(header_lines)
+        return documents
+
+    # Documento y metadata de varias propiedades por su id (chunking: texto completo)
+    def get_properties(self, property_ids):
+        if not self.collection:
+            self.get_or_create_collection()
+
+        property_ids = list(property_ids)
+        if not property_ids:
+            return {}
+
+        if not Config.CHUNKING_ENABLED:
+            records = self.collection.get(ids=property_ids, include=["documents", "metadatas"])
+            return {id_: (doc, meta) for id_, doc, meta in zip(records['ids'], records['documents'], records['metadatas'])}
+
+        documents = self.get_property_documents(property_ids)
+        records = self.collection.get(where={'property_id': {'$in': property_ids}}, include=["metadatas"])
+        metadatas = {}
+        for meta in records['metadatas']:
+            metadatas.setdefault(meta['property_id'], {key: value for key, value in meta.items() if key != 'chunk_index'})
+        return {id_: (documents.get(id_, ''), metadatas[id_]) for id_ in property_ids if id_ in metadatas}
+
+    def lexical_query(self, query_text, n_results):
+        """
+        Búsqueda BM25 en el índice léxico. Devuelve el formato de query()
+        con la puntuación BM25 en 'scores' en lugar de distancias.
+        """
+        ids, scores = self.lexical_index.search(query_text, n_results) if self.lexical_index else ([], [])
+        properties = self.get_properties(ids)
+        found = [(id_, score) for id_, score in zip(ids, scores) if id_ in properties]
+
+        return {
+            'ids': [[id_ for id_, _ in found]],
+            'documents': [[properties[id_][0] for id_, _ in found]],
+            'metadatas': [[properties[id_][1] for id_, _ in found]],
+            'scores': [[score for _, score in found]]
+        }
+
+    # Reconstruye el índice léxico con lo que ya hay en la colección (bbdd anteriores)
+    def rebuild_lexical_index(self, batch_size=5000):
+        if not self.collection:
+            self.get_or_create_collection()
+        if not self.lexical_index:
+            return
+
+        print("Construyendo índice léxico (BM25) desde la colección...")
+        self.lexical_index.reset()
+        offset = 0
+        while True:
+            records = self.collection.get(offset=offset, limit=batch_size, include=["documents", "metadatas"])
+            if not records['ids']:
+                break
+            if Config.CHUNKING_ENABLED:
+                property_ids = list(dict.fromkeys(meta['property_id'] for meta in records['metadatas']))
+                documents = self.get_property_documents(property_ids)
+                self.lexical_index.add(property_ids, [documents[id_] for id_ in property_ids])
+            else:
+                self.lexical_index.add(records['ids'], records['documents'])
+            offset += len(records['ids'])
+        print(f"Índice léxico listo: {self.lexical_index.count} propiedades")
+
+    # Búsqueda de vecinos con el formato de resultados de collection.query
+    def query(self, query_embedding, n_results, where=None):
+        return self.query_many([query_embedding], n_results, where=where)[0]
+
+    def query_many(self, query_embeddings, n_results, where=None):
+        """
+        Varias consultas con el mismo filtro en una sola llamada. Devuelve
+        un resultado por embedding, con el mismo formato que query().
+        """
+        if not self.collection:
+            self.get_or_create_collection()
+
+        if not self.quantized_index:
+            results = self.collection.query(
+                query_embeddings=list(query_embeddings),
+                n_results=n_results,
+                where=where,
+                include=["documents", "metadatas", "distances"]
+            )
+            return [
+                {key: [results[key][i]] for key in ('ids', 'documents', 'metadatas', 'distances')}
+                for i in range(len(query_embeddings))
+            ]
+
+        allowed_ids = None
+        if where:
+            allowed_ids = self.collection.get(where=where, include=[])['ids']
+
+        return [self._query_quantized(embedding, n_results, allowed_ids) for embedding in query_embeddings]
+
+    # Búsqueda en el índice cuantizado; documentos y metadata salen de ChromaDB
+    def _query_quantized(self, query_embedding, n_results, allowed_ids=None):
+        ids, distances = self.quantized_index.search(query_embedding, n_results, allowed_ids=allowed_ids)
+        records = self.collection.get(ids=ids, include=["documents", "metadatas"]) if ids else {'ids': []}
+        by_id = {
+            id_: (doc, meta)
+            for id_, doc, meta in zip(records['ids'], records.get('documents') or [], records.get('metadatas') or [])
+        }
+        found = [(id_, distance) for id_, distance in zip(ids, distances) if id_ in by_id]
+
+        return {
+            'ids': [[id_ for id_, _ in found]],
+            'documents': [[by_id[id_][0] for id_, _ in found]],
+            'metadatas': [[by_id[id_][1] for id_, _ in found]],
+            'distances': [[distance for _, distance in found]]
+        }
+
+    # Muestra de metadata para estimar la selectividad de los filtros
+    def sample_metadatas(self, size=None):
+        """
+        Metadata de una muestra de registros (tramos en posiciones
+        aleatorias), compartida por todas las instancias y renovada tras
+        cada escritura: estimar la selectividad no cuesta una consulta por
+        búsqueda.
+        """
+        size = size or Config.SELECTIVITY_SAMPLE_SIZE
+        with DatabaseManager._shared_lock:
+            sample = DatabaseManager._metadata_samples.get(Config.CHROMADB_PATH)
+        if sample is not None:
+            return sample
+
+        if not self.collection:
+            self.get_or_create_collection()
+
+        total = self.collection.count()
+        if total <= size:
+            sample = self.collection.get(include=["metadatas"])['metadatas']
+        else:
+            slices = 10
+            width = size // slices
+            offsets = sorted(random.sample(range(total - width), slices))
+            sample = []
+            for offset in offsets:
+                sample += self.collection.get(offset=offset, limit=width, include=["metadatas"])['metadatas']
+
+        with DatabaseManager._shared_lock:
+            DatabaseManager._metadata_samples[Config.CHROMADB_PATH] = sample
+        return sample
+
+    # Tras escribir, la muestra de metadata ya no es representativa
+    @staticmethod
+    def _invalidate_sample():
+        with DatabaseManager._shared_lock:
+            DatabaseManager._metadata_samples.pop(Config.CHROMADB_PATH, None)
+
     # Estadisticas de la bbdd
     # TODO: Terminar analisis
     def get_collection_stats(self):
@@ -61,6 +479,15 @@ class DatabaseManager:
 
             # Resetear referencia local
             self.collection = None
+            self._invalidate_sample()
+
+            if self.quantized_index:
+                self.quantized_index.reset()
+                print(f"✅ Índice cuantizado '{Config.QUANTIZED_INDEX_PATH}' eliminado")
+
+            if self.lexical_index:
+                self.lexical_index.reset()
+                print(f"✅ Índice léxico '{Config.LEXICAL_INDEX_PATH}' eliminado")
 
             print("🗑️  Base de datos reseteada completamente")
 
@@ -0,0 +1,142 @@
+import numpy as np
+from openai import OpenAI
+
+from .config import Config
+
+
+class EmbeddingBackend:
+    """
+    Interfaz mínima de un backend de embeddings: recibe una lista de textos
+    y devuelve una lista de vectores en el mismo orden.
+    """
+
+    # Si las llamadas deben pasar por el RateLimiter (APIs remotas)
+    rate_limited = False
+
+    # Identificador del modelo efectivo (se usa como clave de caché)
+    def model_name(self, model, dimensions=None):
+        return f"{model}@{dimensions}" if dimensions else model
+
+    def embed(self, texts, model, dimensions=None):
+        raise NotImplementedError
+
+
+# Truncado estilo Matryoshka: primeras `dimensions` componentes y renormalización L2
+def truncate_embeddings(embeddings, dimensions):
+    matrix = np.asarray(embeddings, dtype=np.float32)[:, :dimensions]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).tolist()
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """Backend por defecto: API de embeddings de OpenAI"""
+
+    rate_limited = True
+
+    def __init__(self):
+        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+
+    def embed(self, texts, model, dimensions=None):
+        # Los modelos text-embedding-3-* reducen la dimensión en el servidor
+        extra = {'dimensions': dimensions} if dimensions else {}
+        response = self.client.embeddings.create(
+            model=model,
+            input=texts,
+            **extra
+        )
+        # La API devuelve 'index' por elemento: reordenamos por seguridad
+        data = sorted(response.data, key=lambda d: d.index)
+        return [d.embedding for d in data]
+
+
+class LocalHashingBackend(EmbeddingBackend):
+    """
+    Backend local, CPU y determinista: n-gramas de caracteres (sobre UTF-8)
+    proyectados con el truco del hashing con signo y normalizados a norma L2.
+    No necesita red ni ajuste previo; todo el lote se procesa con NumPy.
+    """
+
+    _PRIME = np.uint64(1099511628211)
+    _SEPARATOR = b"\x00"
+
+    def __init__(self, dim=None, ngram_range=None):
+        self.dim = dim or Config.LOCAL_EMBEDDING_DIM
+        self.ngram_range = ngram_range or Config.LOCAL_EMBEDDING_NGRAMS
+
+    def model_name(self, model, dimensions=None):
+        low, high = self.ngram_range
+        name = f"local-hash-{self.dim}-{low}{high}"
+        return f"{name}@{dimensions}" if dimensions else name
+
+    @staticmethod
+    def _mix(h):
+        # Finalizador de splitmix64 para repartir bien los bits
+        h = h ^ (h >> np.uint64(33))
+        h = h * np.uint64(0xff51afd7ed558ccd)
+        h = h ^ (h >> np.uint64(33))
+        return h
+
+    def embed(self, texts, model=None, dimensions=None):
+        n_texts = len(texts)
+        if n_texts == 0:
+            return []
+
+        encoded = [text.lower().encode("utf-8") for text in texts]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=n_texts)
+        buffer = np.frombuffer(self._SEPARATOR.join(encoded), dtype=np.uint8).astype(np.uint64)
+
+        # Fila de cada byte; los separadores quedan marcados con -1
+        rows = np.repeat(np.arange(n_texts), lengths + 1)[:len(buffer)]
+        separator_positions = np.cumsum(lengths + 1)[:-1] - 1
+        rows[separator_positions] = -1
+
+        flat_index = []
+        weights = []
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            count = len(buffer) - n + 1
+            if count <= 0:
+                continue
+
+            h = np.zeros(count, dtype=np.uint64)
+            for k in range(n):
+                h = h * self._PRIME + buffer[k:k + count]
+            h = self._mix(h + np.uint64(n))
+
+            # Solo n-gramas completamente dentro de un mismo texto
+            valid = (rows[:count] == rows[n - 1:n - 1 + count]) & (rows[:count] >= 0)
+            h = h[valid]
+            flat_index.append(rows[:count][valid] * self.dim + (h % np.uint64(self.dim)).astype(np.int64))
+            weights.append(np.where((h >> np.uint64(63)) == 1, -1.0, 1.0))
+
+        matrix = np.zeros(n_texts * self.dim)
+        if flat_index:
+            matrix = np.bincount(
+                np.concatenate(flat_index),
+                weights=np.concatenate(weights),
+                minlength=n_texts * self.dim
+            )
+        matrix = matrix.reshape(n_texts, self.dim)
+
+        # Escala sublineal y normalización L2
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+
+        if dimensions and dimensions < self.dim:
+            return truncate_embeddings(matrix, dimensions)
+        return matrix.astype(np.float32).tolist()
+
+
+BACKENDS = {
+    'openai': OpenAIBackend,
+    'local': LocalHashingBackend,
+}
+
+
+# Construye el backend configurado en Config.EMBEDDING_BACKEND
+def create_backend(name=None):
+    name = (name or Config.EMBEDDING_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de embeddings desconocido: '{name}'. Opciones: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from .config import Config
+
+
+class EmbeddingCache:
+    """
+    Caché persistente de embeddings en SQLite, direccionada por contenido:
+    la clave es el hash de (modelo, texto), así un texto sin cambios nunca
+    vuelve a pasar por la API. Se expulsan las entradas menos usadas.
+    """
+
+    # Máximo de variables por sentencia SQLite (límite conservador)
+    _SQL_CHUNK = 500
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or Config.EMBEDDING_CACHE_PATH
+        self.max_entries = max_entries or Config.EMBEDDING_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                created REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # Cachés creadas antes de guardar la fecha de escritura: sus entradas cuentan como antiguas
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")}
+        if 'created' not in columns:
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN created REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    # Devuelve {posición: embedding} para los textos que ya están en caché
+    def get_many(self, model, texts):
+        return {i: embedding for i, (embedding, _) in self._get_rows(model, texts).items()}
+
+    # Como get_many, pero solo entradas escritas hace menos de `max_age` segundos,
+    # con su fecha de escritura: {posición: (embedding, created)}
+    def get_many_fresh(self, model, texts, max_age):
+        return self._get_rows(model, texts, since=time.time() - max_age)
+
+    def _get_rows(self, model, texts, since=None):
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+
+        with self._lock:
+            for start in range(0, len(keys), self._SQL_CHUNK):
+                chunk = keys[start:start + self._SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                query = f"SELECT key, vector, created FROM embeddings WHERE key IN ({placeholders})"
+                params = list(chunk)
+                if since is not None:
+                    query += " AND created >= ?"
+                    params.append(since)
+                for key, vector, created in self._conn.execute(query, params).fetchall():
+                    found[key] = (vector, created)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+        result = {}
+        for i, key in enumerate(keys):
+            if key in found:
+                vector, created = found[key]
+                result[i] = (np.frombuffer(vector, dtype=np.float32).tolist(), created)
+
+        self.hits += len(result)
+        self.misses += len(keys) - len(result)
+        return result
+
+    # Guarda embeddings nuevos y aplica el límite de tamaño
+    def put_many(self, model, texts, embeddings):
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            rows.append((self.make_key(model, text), model, len(vector), vector.tobytes(), now, now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_used, created) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.evictions += overflow
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self.evictions
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+        self.hits = self.misses = self.evictions = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,42 +1,216 @@
-from openai import OpenAI
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from openai import APIConnectionError
 from tqdm import tqdm
 from .config import Config
+from .embedding_backends import create_backend
+from .embedding_cache import EmbeddingCache
+from .rate_limiter import RateLimiter
 
 class EmbeddingsManager:
-    
-    def __init__(self):
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+
+    # Limitador compartido: los límites de la API son por clave, no por instancia
+    _rate_limiter = None
+
+    def __init__(self, use_cache=None, backend=None):
+        # Backend configurable (OpenAI por defecto, 'local' para CI/offline)
+        self.backend = backend or create_backend()
+        # Dimensión reducida de los vectores (None = dimensión nativa del modelo)
+        self.dimensions = Config.EMBEDDING_DIMENSIONS
+
+        if use_cache is None:
+            use_cache = Config.EMBEDDING_CACHE_ENABLED
+        self.cache = EmbeddingCache() if use_cache else None
+
+        # Tokens (estimados) enviados a la API por esta instancia
+        self.tokens_used = 0
+
+        if EmbeddingsManager._rate_limiter is None:
+            EmbeddingsManager._rate_limiter = RateLimiter(
+                Config.EMBEDDING_RPM_LIMIT, Config.EMBEDDING_TPM_LIMIT
+            )
+        self.rate_limiter = EmbeddingsManager._rate_limiter
+
+    # Nombre efectivo del modelo (depende del backend; sirve de clave de caché)
+    def get_model_name(self, use_large_model=False):
+        model = Config.EMBEDDING_MODEL_LARGE if use_large_model else Config.EMBEDDING_MODEL_SMALL
+        return self.backend.model_name(model, self.dimensions)
 
     # Generar embedding para un texto
     def generate_embedding(self, text, use_large_model=False):
+        return self.generate_embedding_with_model(text, use_large_model)[1]
+
+    # Como generate_embedding, pero devuelve también el modelo usado (puede caer al pequeño)
+    def generate_embedding_with_model(self, text, use_large_model=False):
 
         model = Config.EMBEDDING_MODEL_LARGE if use_large_model else Config.EMBEDDING_MODEL_SMALL
-    
+
         try:
-            response = self.client.embeddings.create(
-                model=model,
-                input=text
-            )
-            return response.data[0].embedding
+            return self.backend.model_name(model, self.dimensions), self.backend.embed([text], model, self.dimensions)[0]
         except Exception as e:
             print(f"[Error] Error generando embedding: {e}")
-            
+
             # Si el modelo grande falla ... (fallback al peke)
             if use_large_model:
-                return self.generate_embedding(text, use_large_model=False)
+                return self.generate_embedding_with_model(text, use_large_model=False)
             raise e
-        
+
+    # Estimación rápida de tokens (sin tokenizador)
+    @staticmethod
+    def estimate_tokens(text):
+        return int(len(text) / Config.EMBEDDING_CHARS_PER_TOKEN) + 1
+
+    # Agrupar índices de textos en lotes limitados por nº de textos y tokens
+    @staticmethod
+    def build_batches(texts, batch_size=None, max_tokens=None):
+        """
+        Devuelve listas de índices sobre `texts`. Cada lote respeta tanto el
+        número máximo de textos como el presupuesto estimado de tokens.
+        """
+        batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        max_tokens = max_tokens or Config.EMBEDDING_BATCH_MAX_TOKENS
+
+        batches = []
+        current, current_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = EmbeddingsManager.estimate_tokens(text)
+            if current and (len(current) >= batch_size or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    # Errores transitorios que merece la pena reintentar (429, 5xx, red)
+    @staticmethod
+    def _is_retryable(error):
+        status = getattr(error, 'status_code', None)
+        if status is not None:
+            return status == 429 or status >= 500
+        return isinstance(error, APIConnectionError)
+
+    # Espera exponencial con jitter completo
+    @staticmethod
+    def _backoff_delay(attempt):
+        delay = min(Config.EMBEDDING_BACKOFF_MAX, Config.EMBEDDING_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    # Una sola llamada a la API con varios textos (respetando límites y reintentando)
+    # Devuelve (modelo usado, embeddings) porque puede caer al modelo pequeño
+    # (salvo con allow_fallback=False: al guardar en la bbdd no se mezclan modelos)
+    def _embed_batch(self, batch_texts, use_large_model=False, allow_fallback=True):
+        model = Config.EMBEDDING_MODEL_LARGE if use_large_model else Config.EMBEDDING_MODEL_SMALL
+        batch_tokens = sum(self.estimate_tokens(text) for text in batch_texts)
+
+        attempt = 0
+        while True:
+            if self.backend.rate_limited:
+                self.rate_limiter.acquire(batch_tokens)
+            try:
+                return (
+                    self.backend.model_name(model, self.dimensions),
+                    self.backend.embed(batch_texts, model, self.dimensions)
+                )
+            except Exception as e:
+                if self._is_retryable(e) and attempt < Config.EMBEDDING_MAX_RETRIES:
+                    delay = self._backoff_delay(attempt)
+                    attempt += 1
+                    print(f"[Aviso] Lote fallido ({e}), reintento {attempt} en {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+
+                print(f"[Error] Error generando embeddings del lote: {e}")
+
+                if use_large_model and allow_fallback:
+                    return self._embed_batch(batch_texts, use_large_model=False)
+                raise e
+
     # Generar embeddings para múltiples textos
-    def generate_embeddings_batch(self, texts, use_large_model=False):
-        
-        embeddings = []
-        
-        print(f"Generando embeddings...")
-        for text in tqdm(texts, desc="Embeddings"):
-            embedding = self.generate_embedding(text, use_large_model)
-            embeddings.append(embedding)
-        
+    def generate_embeddings_batch(self, texts, use_large_model=False, batch_size=None, max_workers=None, usage=None,
+                                  allow_fallback=True):
+        """
+        Agrupa los textos en lotes y mantiene hasta `max_workers` peticiones en vuelo.
+        Solo se reintentan los lotes que fallan; el resultado respeta el orden de entrada.
+        Los textos ya presentes en la caché persistente no se envían a la API.
+        Si se pasa el diccionario `usage`, se acumulan en 'tokens' los de esta llamada
+        y en 'fallback' las posiciones embebidas con el modelo pequeño de respaldo.
+        Con `allow_fallback=False` (vectores que se van a guardar en la bbdd) no hay
+        respaldo: si el modelo pedido falla, se propaga el error.
+        """
+        texts = list(texts)
+        embeddings = [None] * len(texts)
+        model = self.get_model_name(use_large_model)
+        max_workers = max_workers or Config.EMBEDDING_MAX_WORKERS
+
+        # 1. Recuperar de caché lo que ya se pagó en ejecuciones anteriores
+        if self.cache:
+            for i, embedding in self.cache.get_many(model, texts).items():
+                embeddings[i] = embedding
+
+        pending = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if self.cache:
+            print(f"Caché de embeddings: {len(texts) - len(pending)} aciertos, {len(pending)} pendientes")
+
+        # 2. Embeber solo los que faltan (los índices de lote se refieren a `pending`)
+        batches = [
+            [pending[j] for j in batch]
+            for batch in self.build_batches([texts[i] for i in pending], batch_size=batch_size)
+        ]
+
+        def store(batch, result):
+            model_used, batch_embeddings = result
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+            tokens = sum(self.estimate_tokens(texts[i]) for i in batch)
+            self.tokens_used += tokens
+            if usage is not None:
+                usage['tokens'] = usage.get('tokens', 0) + tokens
+            if usage is not None and model_used != model:
+                usage.setdefault('fallback', []).extend(batch)
+            # No cacheamos bajo el modelo pedido lo que vino del fallback
+            if self.cache and model_used == model:
+                self.cache.put_many(model, [texts[i] for i in batch], batch_embeddings)
+
+        print(f"Generando embeddings ({len(pending)} textos en {len(batches)} lotes, {max_workers} en paralelo)...")
+        with tqdm(total=len(pending), desc="Embeddings") as pbar:
+            if max_workers <= 1:
+                for batch in batches:
+                    store(batch, self._embed_batch([texts[i] for i in batch], use_large_model, allow_fallback))
+                    pbar.update(len(batch))
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(self._embed_batch, [texts[i] for i in batch], use_large_model, allow_fallback): batch
+                        for batch in batches
+                    }
+                    stored = set()
+                    try:
+                        for future in as_completed(futures):
+                            batch = futures[future]
+                            store(batch, future.result())
+                            stored.add(future)
+                            pbar.update(len(batch))
+                    except Exception:
+                        # Un lote falló sin remedio: no lanzar los que esperan y guardar
+                        # (en caché) los que ya terminaron o estaban en vuelo antes de propagar
+                        for future in futures:
+                            future.cancel()
+                        wait(futures)
+                        for future, batch in futures.items():
+                            if future not in stored and not future.cancelled() and future.exception() is None:
+                                store(batch, future.result())
+                        raise
+
         print(" Embeddings generados correctamente.")
         return embeddings
-    
-    
\ No newline at end of file
+
+    # Estadísticas de la caché persistente (aciertos, fallos, tamaño)
+    def get_cache_stats(self):
+        return self.cache.stats() if self.cache else {}
+
+
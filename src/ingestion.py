@@ -0,0 +1,401 @@
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from .config import Config
+from .data_processor import DataProcessor
+from .database_manager import DatabaseManager
+from .embeddings_manager import EmbeddingsManager
+from .near_duplicates import NearDuplicateDetector
+
+
+class IngestionPipeline:
+    """
+    Ingesta en streaming con memoria acotada: el fichero (CSV o Parquet/Arrow) se lee por bloques
+    (`chunksize`) y cada bloque pasa por limpiar -> textos/metadata ->
+    embeddings -> escritura. Lo escrito queda guardado aunque falle un
+    bloque posterior. Los ids son estables, así que re-ejecutar la ingesta
+    solo embebe y escribe las filas nuevas o modificadas.
+
+    Con Config.PIPELINE_OVERLAP cada etapa corre en sus propios hilos,
+    unidas por colas acotadas: mientras un bloque se embebe, el siguiente
+    se prepara y el anterior se escribe, de modo que el tiempo total tiende
+    al de la etapa más lenta. En memoria hay como mucho unos pocos bloques
+    (tamaño de las colas + hilos por etapa).
+
+    Cada etapa recibe y devuelve un diccionario por bloque ('index', 'df',
+    'texts', ...), de modo que el bloque de origen se conoce hasta el final.
+    """
+
+    # Marca de fin de datos en las colas
+    _DONE = object()
+
+    def __init__(self, embeddings_manager=None, db_manager=None, use_large_model=True):
+        self._embeddings_manager = embeddings_manager
+        self._db_manager = db_manager
+        self.use_large_model = use_large_model
+
+        self._seen_urls = set()
+        # Un solo detector para toda la ingesta: detecta copias entre bloques
+        self.near_duplicates = NearDuplicateDetector() if Config.NEAR_DUP_ENABLED else None
+        # Pool de procesos para textos/metadata (solo durante run())
+        self._process_pool = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'rows_read': 0,
+            'rows_cleaned': 0,
+            'rows_skipped': 0,
+            'rows_near_duplicates': 0,
+            'rows_written': 0,
+            'chunks': 0,
+            'tokens_used': 0,
+            'elapsed_seconds': 0.0,
+            'stages': {}
+        }
+
+    # Se crea al primer uso: estimate() (dry-run) no necesita backend ni clave de API
+    @property
+    def embeddings_manager(self):
+        if self._embeddings_manager is None:
+            self._embeddings_manager = EmbeddingsManager()
+        return self._embeddings_manager
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            self._db_manager = DatabaseManager()
+        return self._db_manager
+
+    def _count(self, key, value):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    # 1. Lectura por bloques (los bloques de `skip_chunks` ya están guardados)
+    def read_chunks(self, csv_file, chunksize=None, skip_chunks=None):
+        chunksize = chunksize or Config.INGESTION_CHUNK_SIZE
+        skip_chunks = skip_chunks or set()
+
+        for index, chunk in enumerate(DataProcessor.iter_file_chunks(csv_file, chunksize)):
+            if index in skip_chunks:
+                self._replay_chunk(chunk)
+                continue
+
+            self._count('rows_read', len(chunk))
+            yield {'index': index, 'df': chunk, 'rows': len(chunk)}
+
+    # Bloque ya guardado (reanudación): no se embebe ni se escribe, pero sus URLs y
+    # sus anuncios se recuerdan para seguir descartando copias en los bloques siguientes
+    def _replay_chunk(self, chunk):
+        if not self.near_duplicates:
+            chunk = DataProcessor.normalize_schema(chunk)
+            if 'url_inmueble' in chunk.columns:
+                self._seen_urls.update(chunk['url_inmueble'].dropna())
+            return
+
+        df_clean = DataProcessor.clean_dataframe(chunk, verbose=False)
+        if 'url_inmueble' in df_clean.columns:
+            df_clean = df_clean[~df_clean['url_inmueble'].isin(self._seen_urls)]
+            self._seen_urls.update(df_clean['url_inmueble'].dropna())
+        if len(df_clean):
+            texts, metadata = DataProcessor.build_texts_and_metadatas(df_clean)
+            self.near_duplicates.find_duplicates(texts, metadata)
+
+    # 2. Limpieza (con deduplicación de URLs entre bloques; siempre en orden)
+    def clean_chunk(self, batch):
+        df_clean = DataProcessor.clean_dataframe(batch['df'])
+
+        if 'url_inmueble' in df_clean.columns:
+            df_clean = df_clean[~df_clean['url_inmueble'].isin(self._seen_urls)]
+            self._seen_urls.update(df_clean['url_inmueble'].dropna())
+
+        self._count('rows_cleaned', len(df_clean))
+        batch['df'] = df_clean
+        return batch
+
+    # 3. Textos descriptivos (o trozos) y metadata estructurada
+    # Se omiten los casi duplicados y las filas sin cambios respecto a la bbdd
+    # (mismo hash de contenido)
+    def prepare_chunk(self, batch):
+        df_clean = batch['df']
+        if self._process_pool:
+            texts, metadata = self._process_pool.submit(DataProcessor.build_texts_and_metadatas, df_clean).result()
+        else:
+            texts, metadata = DataProcessor.build_texts_and_metadatas(df_clean)
+
+        batch['near_duplicates'] = 0
+        if self.near_duplicates and texts:
+            before = len(texts)
+            df_clean, texts, metadata = self.near_duplicates.deduplicate(df_clean, texts, metadata)
+            batch['near_duplicates'] = before - len(texts)
+            self._count('rows_near_duplicates', batch['near_duplicates'])
+
+        changed = self.db_manager.get_changed_indices(texts, metadata) if texts else []
+        batch['skipped'] = len(texts) - len(changed)
+        self._count('rows_skipped', batch['skipped'])
+
+        batch['df'] = df_clean.iloc[changed]
+        batch['texts'] = [texts[i] for i in changed]
+        batch['metadata'] = [metadata[i] for i in changed]
+        if Config.CHUNKING_ENABLED:
+            batch['chunks'] = [
+                DataProcessor.build_text_chunks(row) for _, row in batch['df'].iterrows()
+            ]
+        return batch
+
+    # 4. Embeddings del bloque
+    def embed_chunk(self, batch):
+        if Config.CHUNKING_ENABLED:
+            texts = [chunk for chunks in batch['chunks'] for chunk in chunks]
+        else:
+            texts = batch['texts']
+
+        # Sin respaldo al modelo pequeño: una colección nunca mezcla modelos. Si el
+        # modelo falla, el bloque falla y el trabajo se puede reanudar desde aquí
+        usage = {}
+        batch['embeddings'] = self.embeddings_manager.generate_embeddings_batch(
+            texts, use_large_model=self.use_large_model, usage=usage, allow_fallback=False
+        ) if texts else []
+        batch['tokens'] = usage.get('tokens', 0)
+        self._count('tokens_used', batch['tokens'])
+        return batch
+
+    # 5. Escritura del bloque en la bbdd
+    def write_chunk(self, batch):
+        if batch['texts'] and Config.CHUNKING_ENABLED:
+            self.db_manager.add_property_chunks_to_db(
+                batch['chunks'], batch['embeddings'], batch['metadata'], batch['texts']
+            )
+        elif batch['texts']:
+            self.db_manager.add_properties_to_db(
+                None, batch['texts'], batch['embeddings'], batch['metadata']
+            )
+
+        batch['written'] = len(batch['texts'])
+        self._count('rows_written', batch['written'])
+        self._count('chunks', 1)
+        return batch
+
+    # Estimación sin llamar a la API ni escribir: filas y tokens que se embeberían
+    def estimate(self, csv_file, chunksize=None):
+        """
+        Recorre el fichero con las mismas etapas de lectura, limpieza y
+        preparación (se descartan igual las filas sin cambios y los casi
+        duplicados). Los tokens son una cota superior: no se descuentan
+        los textos que ya estén en la caché de embeddings.
+        """
+        start = time.time()
+        estimate = {'rows_read': 0, 'rows_to_embed': 0, 'texts_to_embed': 0, 'estimated_tokens': 0}
+
+        # Sin escrituras: la bbdd se abre en solo lectura (si no existe, todo es nuevo)
+        own_db_manager = self._db_manager is None
+        if own_db_manager:
+            self._db_manager = DatabaseManager(read_only=True)
+
+        try:
+            for batch in self.read_chunks(csv_file, chunksize):
+                batch = self.prepare_chunk(self.clean_chunk(batch))
+                if Config.CHUNKING_ENABLED:
+                    texts = [chunk for chunks in batch['chunks'] for chunk in chunks]
+                else:
+                    texts = batch['texts']
+
+                estimate['rows_read'] += batch['rows']
+                estimate['rows_to_embed'] += len(batch['texts'])
+                estimate['texts_to_embed'] += len(texts)
+                estimate['estimated_tokens'] += sum(EmbeddingsManager.estimate_tokens(text) for text in texts)
+        finally:
+            if own_db_manager:
+                self._db_manager = None
+
+        estimate['rows_skipped'] = self.stats['rows_skipped']
+        estimate['rows_near_duplicates'] = self.stats['rows_near_duplicates']
+        estimate['elapsed_seconds'] = round(time.time() - start, 2)
+        return estimate
+
+    # Etapas posteriores a la lectura: (nombre, función, hilos)
+    def _stages(self):
+        return [
+            ('prepare', self.prepare_chunk, max(1, Config.PIPELINE_PREPARE_WORKERS)),
+            ('embed', self.embed_chunk, max(1, Config.PIPELINE_EMBED_WORKERS)),
+            ('write', self.write_chunk, max(1, Config.PIPELINE_WRITE_WORKERS)),
+        ]
+
+    # Ejecuta el pipeline completo sobre un CSV
+    def run(self, csv_file, chunksize=None, skip_chunks=None, on_chunk=None):
+        """
+        `skip_chunks`: índices de bloque que no se vuelven a procesar.
+        `on_chunk(batch)`: se llama cuando un bloque queda guardado (checkpoint).
+        """
+        start = time.time()
+        # Antes de lanzar los hilos de las etapas, para que compartan una sola instancia
+        self.embeddings_manager
+        self.db_manager
+
+        # Lectura y limpieza van juntas: la deduplicación entre bloques exige orden
+        batches = (self.clean_chunk(batch) for batch in self.read_chunks(csv_file, chunksize, skip_chunks))
+
+        # Con varios procesos, cada hilo de 'prepare' delega el trabajo de CPU en el pool
+        if Config.PROCESSING_WORKERS > 1:
+            self._process_pool = DataProcessor.create_process_pool()
+
+        try:
+            if Config.PIPELINE_OVERLAP:
+                saved = self._run_overlapped(batches)
+            else:
+                saved = self._run_sequential(batches)
+
+            for batch in saved:
+                if on_chunk:
+                    on_chunk(batch)
+                print(f"Bloque {batch['index'] + 1} guardado: {batch['written']} propiedades "
+                      f"({self.stats['rows_written']} en total)")
+        finally:
+            if self._process_pool:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+        self.stats['elapsed_seconds'] = round(time.time() - start, 2)
+        if self.stats['stages']:
+            self._print_stage_stats()
+        return self.stats
+
+    def _run_sequential(self, batches):
+        for batch in batches:
+            for _, stage, _ in self._stages():
+                batch = stage(batch)
+            yield batch
+
+    def _run_overlapped(self, batches):
+        """
+        Cada etapa lee de su cola de entrada y escribe en la de la siguiente.
+        Los bloques pueden terminar desordenados si una etapa tiene varios
+        hilos (el índice viaja en el bloque). Ante un error se paran todos
+        los hilos y el error se relanza aquí.
+        """
+        stages = self._stages()
+        queue_size = Config.PIPELINE_QUEUE_SIZE
+        queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        stop = threading.Event()
+        errors = []
+
+        metrics = {'read': {'workers': 1, 'busy_seconds': 0.0}}
+        for name, _, workers in stages:
+            metrics[name] = {'workers': workers, 'busy_seconds': 0.0, 'depth_samples': 0,
+                             'depth_total': 0, 'max_queue_depth': 0}
+        pending_workers = {name: workers for name, _, workers in stages}
+        metrics_lock = threading.Lock()
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return self._DONE
+
+        def fail(error):
+            errors.append(error)
+            stop.set()
+
+        def produce():
+            try:
+                iterator = iter(batches)
+                while not stop.is_set():
+                    t0 = time.perf_counter()
+                    batch = next(iterator, self._DONE)
+                    metrics['read']['busy_seconds'] += time.perf_counter() - t0
+                    if batch is self._DONE or not put(queues[0], batch):
+                        break
+                put(queues[0], self._DONE)
+            except Exception as e:
+                fail(e)
+
+        def work(name, stage, q_in, q_out):
+            try:
+                while not stop.is_set():
+                    depth = q_in.qsize()
+                    item = get(q_in)
+                    if item is self._DONE:
+                        # Avisar al resto de hilos de la etapa; el último cierra la siguiente cola
+                        put(q_in, self._DONE)
+                        with metrics_lock:
+                            pending_workers[name] -= 1
+                            last = pending_workers[name] == 0
+                        if last:
+                            put(q_out, self._DONE)
+                        return
+
+                    t0 = time.perf_counter()
+                    result = stage(item)
+                    with metrics_lock:
+                        stage_metrics = metrics[name]
+                        stage_metrics['busy_seconds'] += time.perf_counter() - t0
+                        stage_metrics['depth_samples'] += 1
+                        stage_metrics['depth_total'] += depth
+                        stage_metrics['max_queue_depth'] = max(stage_metrics['max_queue_depth'], depth)
+                    if not put(q_out, result):
+                        return
+            except Exception as e:
+                fail(e)
+
+        threads = [threading.Thread(target=produce, daemon=True)]
+        for position, (name, stage, workers) in enumerate(stages):
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=work, args=(name, stage, queues[position], queues[position + 1]), daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                batch = get(queues[-1])
+                if batch is self._DONE:
+                    break
+                yield batch
+        finally:
+            # Termina también los hilos si el consumidor se detiene antes de tiempo
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.stats['stages'] = self._summarize_metrics(metrics)
+
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def _summarize_metrics(metrics):
+        summary = {}
+        for name, values in metrics.items():
+            samples = values.get('depth_samples', 0)
+            summary[name] = {
+                'workers': values['workers'],
+                'busy_seconds': round(values['busy_seconds'], 2),
+                'avg_queue_depth': round(values['depth_total'] / samples, 2) if samples else None,
+                'max_queue_depth': values.get('max_queue_depth')
+            }
+        return summary
+
+    # Resumen por etapa: la de mayor tiempo ocupado por hilo es el cuello de botella
+    def _print_stage_stats(self):
+        stages = self.stats['stages']
+        bottleneck = max(stages, key=lambda name: stages[name]['busy_seconds'] / stages[name]['workers'])
+
+        print("\nEtapas de la ingesta (tiempo ocupado / profundidad de su cola de entrada):")
+        for name, values in stages.items():
+            depth = ""
+            if values['avg_queue_depth'] is not None:
+                depth = f", cola media {values['avg_queue_depth']} (máx. {values['max_queue_depth']})"
+            print(f"  - {name}: {values['busy_seconds']}s en {values['workers']} hilo(s){depth}")
+        print(f"Cuello de botella: {bottleneck}")
@@ -0,0 +1,263 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from .config import Config
+from .data_processor import DataProcessor
+from .ingestion import IngestionPipeline
+
+
+class IngestionJob:
+    """
+    Ingesta como trabajo reanudable. Cada bloque guardado en la bbdd se
+    registra en un log de checkpoints (JSON lines, con fsync) bajo
+    Config.INGESTION_JOBS_PATH. `resume()` continúa desde el último bloque
+    confirmado y `get_status()` reconstruye el progreso (filas/s, ETA,
+    tokens) leyendo ese log, por lo que cualquier proceso (p. ej. el
+    sidebar de Streamlit) puede consultarlo.
+
+    Mientras se ejecuta, el trabajo tiene un fichero de lock con el pid
+    del proceso dueño: no puede reanudarse desde otro proceso a la vez, y
+    un lock cuyo proceso ya no existe se considera abandonado.
+    """
+
+    def __init__(self, job_id, jobs_path=None):
+        self.job_id = job_id
+        self.jobs_path = jobs_path or Config.INGESTION_JOBS_PATH
+        self.log_path = os.path.join(self.jobs_path, f"{job_id}.jsonl")
+        self.lock_path = os.path.join(self.jobs_path, f"{job_id}.lock")
+        self.thread = None
+
+    # Crea un trabajo nuevo para un CSV
+    @classmethod
+    def create(cls, csv_file, chunksize=None, jobs_path=None, use_large_model=True):
+        stem = os.path.splitext(os.path.basename(csv_file))[0]
+        # Sufijo aleatorio: dos ficheros con el mismo nombre (otra carpeta u otro
+        # formato) lanzados en el mismo segundo no comparten log
+        job = cls(f"{datetime.now():%Y%m%d_%H%M%S}_{stem}_{uuid.uuid4().hex[:8]}", jobs_path)
+        os.makedirs(job.jobs_path, exist_ok=True)
+
+        job._append({
+            'event': 'created',
+            'csv_file': os.path.abspath(csv_file),
+            'chunksize': chunksize or Config.INGESTION_CHUNK_SIZE,
+            'use_large_model': use_large_model,
+            'estimated_rows': DataProcessor.count_rows(csv_file)
+        })
+        return job
+
+    # Trabajos existentes, del más reciente al más antiguo
+    @classmethod
+    def list_jobs(cls, jobs_path=None):
+        jobs_path = jobs_path or Config.INGESTION_JOBS_PATH
+        if not os.path.isdir(jobs_path):
+            return []
+        names = sorted((f for f in os.listdir(jobs_path) if f.endswith('.jsonl')), reverse=True)
+        return [cls(name[:-len('.jsonl')], jobs_path) for name in names]
+
+    def _append(self, event):
+        event = {**event, 'ts': time.time()}
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_log(self):
+        events = []
+        if not os.path.exists(self.log_path):
+            return events
+        with open(self.log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir tras una caída: se ignora
+                    continue
+        return events
+
+    # Bloques ya confirmados en la bbdd
+    def committed_chunks(self):
+        return {e['index'] for e in self.read_log() if e['event'] == 'chunk'}
+
+    def _checkpoint(self, batch):
+        self._append({
+            'event': 'chunk',
+            'index': batch['index'],
+            'rows': batch['rows'],
+            'written': batch['written'],
+            'skipped': batch.get('skipped', 0),
+            'near_duplicates': batch.get('near_duplicates', 0),
+            'tokens': batch.get('tokens', 0)
+        })
+
+    # ¿Sigue vivo el proceso? Sin comprobación portable fuera de POSIX, se asume que sí
+    @staticmethod
+    def _pid_alive(pid):
+        if pid == os.getpid() or os.name != 'posix':
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    # Pid del proceso que ejecuta el trabajo, o None si nadie lo tiene
+    def lock_owner(self):
+        try:
+            with open(self.lock_path) as f:
+                content = f.read().strip()
+            created = os.path.getmtime(self.lock_path)
+        except FileNotFoundError:
+            return None
+
+        if not content.isdigit():
+            # Lock recién creado, aún sin pid escrito
+            return -1 if time.time() - created < 60 else None
+        pid = int(content)
+        return pid if self._pid_alive(pid) else None
+
+    def _acquire_lock(self):
+        os.makedirs(self.jobs_path, exist_ok=True)
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                owner = self.lock_owner()
+                if owner is not None:
+                    raise RuntimeError(
+                        f"El trabajo '{self.job_id}' ya se está ejecutando (proceso {owner}). "
+                        f"Si no es así, borra '{self.lock_path}'."
+                    )
+                # Lock de un proceso que murió: se retira y se vuelve a intentar
+                try:
+                    os.remove(self.lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return
+
+    def _release_lock(self):
+        try:
+            with open(self.lock_path) as f:
+                if f.read().strip() != str(os.getpid()):
+                    return
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    # Ejecuta (o reanuda) el trabajo hasta el final
+    def run(self):
+        events = self.read_log()
+        if not events:
+            raise ValueError(f"No existe el trabajo de ingesta '{self.job_id}'")
+
+        self._acquire_lock()
+        try:
+            return self._run(events[0])
+        finally:
+            self._release_lock()
+
+    def _run(self, info):
+        # Releído con el lock tomado: otro proceso pudo terminarlo mientras tanto
+        if any(e['event'] == 'completed' for e in self.read_log()):
+            print(f"El trabajo '{self.job_id}' ya está completado.")
+            return self.get_status()
+
+        committed = self.committed_chunks()
+        self._append({'event': 'started' if not committed else 'resumed', 'skipped_chunks': len(committed)})
+        if committed:
+            print(f"Reanudando '{self.job_id}': {len(committed)} bloques ya guardados")
+
+        try:
+            pipeline = IngestionPipeline(use_large_model=info.get('use_large_model', True))
+            pipeline.run(info['csv_file'], chunksize=info['chunksize'],
+                         skip_chunks=committed, on_chunk=self._checkpoint)
+        except Exception as e:
+            self._append({'event': 'failed', 'error': str(e)})
+            raise
+
+        self._append({'event': 'completed'})
+        return self.get_status()
+
+    # Alias explícito para continuar un trabajo interrumpido
+    def resume(self):
+        return self.run()
+
+    # Ejecuta el trabajo en un hilo (para no bloquear la interfaz)
+    def start_background(self):
+        def target():
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[Error] Trabajo de ingesta '{self.job_id}' fallido: {e}")
+
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def get_status(self):
+        """
+        Estado del trabajo a partir del log: 'pending', 'running',
+        'completed', 'failed' o 'interrupted' (arrancado, pero ningún proceso
+        vivo tiene su lock: murió sin registrar el fallo; usar resume()).
+        """
+        events = self.read_log()
+        if not events:
+            return {'job_id': self.job_id, 'state': 'unknown'}
+
+        info = events[0]
+        chunks = [e for e in events if e['event'] == 'chunk']
+        runs = [e for e in events if e['event'] in ('started', 'resumed')]
+        last = events[-1]['event']
+
+        if last == 'completed':
+            state = 'completed'
+        elif last == 'failed':
+            state = 'failed'
+        elif runs:
+            state = 'running' if self.lock_owner() is not None else 'interrupted'
+        else:
+            state = 'pending'
+
+        rows_done = sum(e['rows'] for e in chunks)
+        estimated_rows = info.get('estimated_rows') or 0
+
+        # Velocidad medida solo en la ejecución actual (desde el último arranque)
+        rows_per_second = 0.0
+        if runs:
+            run_start = runs[-1]['ts']
+            run_chunks = [e for e in chunks if e['ts'] >= run_start]
+            elapsed = (events[-1]['ts'] if state != 'running' else time.time()) - run_start
+            if run_chunks and elapsed > 0:
+                rows_per_second = sum(e['rows'] for e in run_chunks) / elapsed
+
+        remaining = max(estimated_rows - rows_done, 0)
+        eta_seconds = round(remaining / rows_per_second, 1) if state == 'running' and rows_per_second else None
+
+        return {
+            'job_id': self.job_id,
+            'csv_file': info.get('csv_file'),
+            'state': state,
+            'chunks_done': len(chunks),
+            'rows_done': rows_done,
+            'rows_written': sum(e['written'] for e in chunks),
+            'rows_skipped': sum(e.get('skipped', 0) for e in chunks),
+            'rows_near_duplicates': sum(e.get('near_duplicates', 0) for e in chunks),
+            'estimated_rows': estimated_rows,
+            'progress': 1.0 if state == 'completed' else (
+                round(min(rows_done / estimated_rows, 1.0), 4) if estimated_rows else None
+            ),
+            'rows_per_second': round(rows_per_second, 1),
+            'eta_seconds': eta_seconds,
+            'tokens_used': sum(e.get('tokens', 0) for e in chunks),
+            'error': events[-1].get('error') if state == 'failed' else None,
+            'updated_at': events[-1]['ts']
+        }
@@ -0,0 +1,219 @@
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import unicodedata
+
+import numpy as np
+
+from .config import Config
+from .data_processor import DataProcessor
+
+
+class LexicalIndex:
+    """
+    Índice invertido en memoria con puntuación BM25 sobre los textos
+    descriptivos de las propiedades. Complementa la búsqueda vectorial en
+    términos exactos (calles, barrios, "ático"), que los embeddings no
+    siempre ponen arriba, y permite buscar aunque la API de embeddings no
+    responda.
+
+    Se actualiza de forma incremental en cada alta (upsert por id de
+    propiedad) y se persiste como un log de documentos (JSON lines) que se
+    reproduce al cargar y se compacta cuando acumula demasiadas versiones
+    antiguas.
+    """
+
+    _TOKENS = re.compile(r"\w+")
+
+    # Palabras vacías (es/ca) y etiquetas de los textos descriptivos: aparecen
+    # en casi todos los anuncios, no discriminan y alargan las listas a recorrer
+    STOPWORDS = {
+        'a', 'al', 'amb', 'con', 'de', 'del', 'd', 'el', 'els', 'en', 'es', 'i', 'l', 'la', 'las', 'les',
+        'lo', 'los', 'o', 'para', 'per', 'por', 'que', 'se', 'sin', 'su', 'sus', 'un', 'una', 'y'
+    }
+
+    def __init__(self, path=None):
+        self.path = path or Config.LEXICAL_INDEX_PATH
+        self.k1 = Config.BM25_K1
+        self.b = Config.BM25_B
+
+        self.ids = []
+        self.id_to_slot = {}
+        self.lengths = []
+        self.total_length = 0
+        self.postings = {}
+        self._terms = {}
+        self._term_arrays = {}
+        self._length_array = None
+        self._log_lines = 0
+        # Altas (ingesta por bloques, en paralelo) y búsquedas concurrentes
+        self._lock = threading.RLock()
+
+        self._labels = {token for _, label in DataProcessor.TEXT_LABELS for token in self.tokenize(label, False)}
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def count(self):
+        return len(self.id_to_slot)
+
+    # Minúsculas, sin acentos ("Ático" == "atico") y sin palabras vacías
+    def tokenize(self, text, drop_common=True):
+        text = unicodedata.normalize('NFKD', str(text).lower())
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        tokens = self._TOKENS.findall(text)
+        if drop_common:
+            tokens = [t for t in tokens if t not in self.STOPWORDS and t not in self._labels]
+        return tokens
+
+    def _term_counts(self, text):
+        counts = {}
+        for token in self.tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        return counts
+
+    def _load(self):
+        if not os.path.exists(self._file('docs.jsonl')):
+            return
+
+        with open(self._file('docs.jsonl'), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir tras una caída: se ignora
+                    continue
+                self._log_lines += 1
+                self._index(record['id'], record['terms'])
+
+    # Alta o sustitución de un documento en las estructuras en memoria
+    def _index(self, doc_id, terms):
+        self._unindex(doc_id)
+
+        slot = len(self.ids)
+        self.ids.append(doc_id)
+        self.id_to_slot[doc_id] = slot
+        length = sum(terms.values())
+        self.lengths.append(length)
+        self.total_length += length
+        self._terms[slot] = terms
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[slot] = tf
+
+    def _unindex(self, doc_id):
+        slot = self.id_to_slot.pop(doc_id, None)
+        if slot is None:
+            return
+        self.total_length -= self.lengths[slot]
+        self.lengths[slot] = 0
+        for term in self._terms.pop(slot):
+            postings = self.postings[term]
+            del postings[slot]
+            if not postings:
+                del self.postings[term]
+
+    # Añade (o sobrescribe, si el id ya existe) documentos al índice
+    def add(self, ids, texts):
+        with self._lock:
+            records = [{'id': doc_id, 'terms': self._term_counts(text)} for doc_id, text in zip(ids, texts)]
+            if not records:
+                return
+
+            with open(self._file('docs.jsonl'), 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log_lines += len(records)
+
+            for record in records:
+                self._index(record['id'], record['terms'])
+            # Cambian N, la longitud media y los df: los pesos se recalculan al buscar
+            self._term_arrays = {}
+            self._length_array = None
+
+            # Más de la mitad del log son versiones antiguas: reescribirlo
+            if self._log_lines > 2 * max(self.count, 1000):
+                self._compact()
+
+    def _compact(self):
+        tmp_path = self._file('docs.jsonl.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for doc_id, slot in self.id_to_slot.items():
+                f.write(json.dumps({'id': doc_id, 'terms': self._terms[slot]}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._file('docs.jsonl'))
+        self._log_lines = self.count
+
+    # Posiciones y peso BM25 de cada documento que contiene el término
+    def _weights(self, term):
+        arrays = self._term_arrays.get(term)
+        if arrays is not None:
+            return arrays
+
+        postings = self.postings.get(term)
+        if not postings:
+            return None
+
+        n_docs = self.count
+        avg_length = self.total_length / n_docs
+        idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+
+        slots = np.fromiter(postings.keys(), dtype=np.int64, count=len(postings))
+        tf = np.fromiter(postings.values(), dtype=np.float64, count=len(postings))
+        if self._length_array is None:
+            self._length_array = np.asarray(self.lengths, dtype=np.float64)
+        lengths = self._length_array[slots]
+        weights = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / avg_length))
+
+        arrays = (slots, weights)
+        self._term_arrays[term] = arrays
+        return arrays
+
+    def search(self, query, n_results):
+        """
+        Devuelve (ids, puntuaciones BM25) de los `n_results` documentos con
+        mayor puntuación para la consulta (solo los que comparten algún
+        término con ella).
+        """
+        with self._lock:
+            if not self.count or n_results <= 0:
+                return [], []
+
+            arrays = [a for a in (self._weights(term) for term in set(self.tokenize(query))) if a is not None]
+            if not arrays:
+                return [], []
+
+            if len(arrays) == 1:
+                slots, scores = arrays[0]
+            else:
+                # Suma por documento en un array denso (más rápido que agrupar los postings)
+                scores = np.bincount(np.concatenate([a[0] for a in arrays]),
+                                     weights=np.concatenate([a[1] for a in arrays]))
+                slots = np.arange(len(scores))
+
+            n_results = min(n_results, len(slots))
+            top = np.argpartition(-scores, n_results - 1)[:n_results]
+            top = top[scores[top] > 0]
+            # Orden estable: a igual puntuación, el documento indexado antes
+            top = top[np.lexsort((slots[top], -scores[top]))]
+            return [self.ids[slots[i]] for i in top], scores[top].tolist()
+
+    def reset(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+            os.makedirs(self.path, exist_ok=True)
+            self.ids = []
+            self.id_to_slot = {}
+            self.lengths = []
+            self.total_length = 0
+            self.postings = {}
+            self._terms = {}
+            self._term_arrays = {}
+            self._length_array = None
+            self._log_lines = 0
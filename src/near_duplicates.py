@@ -0,0 +1,318 @@
+import hashlib
+import re
+import threading
+import zlib
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from .config import Config
+from .data_processor import DataProcessor
+
+
+class NearDuplicateDetector:
+    """
+    Detección de anuncios casi duplicados (el mismo piso publicado por
+    varias agencias o portales) con MinHash + LSH por bandas, en tiempo
+    casi lineal. Dos anuncios son duplicados si el Jaccard estimado de sus
+    textos supera el umbral Y sus campos clave (precio, metros,
+    Habitaciones, barrio) son compatibles.
+
+    No se comparan los anuncios con menos de Config.NEAR_DUP_MIN_SHINGLES
+    shingles propios (fuera del título y la ubicación, que el portal genera
+    con una plantilla): dos pisos del mismo barrio sin descripción tendrían
+    el mismo texto. Tampoco son duplicados dos anuncios del mismo portal
+    con distinto id de anuncio en la URL.
+
+    El detector guarda estado entre llamadas: en una ingesta por bloques,
+    un anuncio se compara también con los de bloques anteriores. Se queda
+    siempre el primero visto; sus copias se descartan antes de embeber y
+    sus URLs se enlazan en la metadata del representante.
+
+    El estado es compacto (firmas y campos clave en matrices numpy, cubos
+    LSH como arrays ordenados de hashes enteros, ~0,6 KB por
+    representante) y está acotado por Config.NEAR_DUP_MAX_REPRESENTATIVES:
+    pasado el límite, los anuncios nuevos se siguen comparando con los ya
+    vistos pero no se registran.
+    """
+
+    _MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+    _MAX_HASH = np.uint64((1 << 32) - 1)
+
+    # Etiquetas de los textos descriptivos ("Propiedad: ", ...): no aportan similitud
+    _LABELS = re.compile(
+        r"^(?:" + "|".join(re.escape(label) for _, label in DataProcessor.TEXT_LABELS) + r"): ",
+        re.MULTILINE
+    )
+    _WORDS = re.compile(r"\w+")
+
+    # Líneas de plantilla: el título ("Flat with heating in <barrio> <ciudad>") y la ubicación
+    _TEMPLATE_LINES = re.compile(
+        r"^(?:" + "|".join(
+            re.escape(label) for col, label in DataProcessor.TEXT_LABELS if col in ('titulo', 'direccion')
+        ) + r"): .*$",
+        re.MULTILINE
+    )
+
+    # Id del anuncio dentro de cada portal, sacado de la URL
+    _LISTING_IDS = {
+        'habitaclia.com': re.compile(r"-i(\d+)\.htm"),
+        'pisos.com': re.compile(r"-(\d+_\d+)/?$"),
+    }
+    _PORTALS = list(_LISTING_IDS)
+
+    # Representantes que se acumulan en los cubos pendientes antes de
+    # fusionarlos con los arrays ordenados
+    _MERGE_EVERY = 16384
+
+    def __init__(self, threshold=None, num_perm=None, bands=None, shingle_size=None, numeric_tolerance=None):
+        self.threshold = threshold or Config.NEAR_DUP_THRESHOLD
+        self.num_perm = num_perm or Config.NEAR_DUP_NUM_PERM
+        self.bands = bands or Config.NEAR_DUP_BANDS
+        self.shingle_size = shingle_size or Config.NEAR_DUP_SHINGLE_SIZE
+        self.numeric_tolerance = numeric_tolerance if numeric_tolerance is not None else Config.NEAR_DUP_NUMERIC_TOLERANCE
+
+        if self.num_perm % self.bands:
+            raise ValueError(f"NEAR_DUP_NUM_PERM ({self.num_perm}) debe ser múltiplo de NEAR_DUP_BANDS ({self.bands})")
+        self.rows_per_band = self.num_perm // self.bands
+
+        # Permutaciones fijas (semilla constante) para que las firmas sean reproducibles
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, 1 << 32, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=self.num_perm, dtype=np.uint64)
+
+        # Hash entero de cada banda: combinación lineal de sus valores (mod 2^64)
+        self._band_multipliers = rng.randint(1, 1 << 62, size=self.rows_per_band, dtype=np.uint64) * 2 + 1
+        self.max_representatives = Config.NEAR_DUP_MAX_REPRESENTATIVES
+        self.min_shingles = Config.NEAR_DUP_MIN_SHINGLES
+
+        # Anuncios representativos ya vistos: firma (32 bits por permutación) y
+        # campos clave (precio, metros, Habitaciones, id de barrio, portal, hash
+        # del id del anuncio; NaN = sin dato)
+        self._count = 0
+        self._signatures = np.empty((0, self.num_perm), dtype=np.uint32)
+        self._keys = np.empty((0, 6), dtype=np.float64)
+        self._barrio_ids = {}
+        # Cubos LSH por banda: (hashes ordenados, posiciones) + altas recientes sin fusionar
+        self._buckets = [(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int32)) for _ in range(self.bands)]
+        self._pending = [{} for _ in range(self.bands)]
+        self._pending_count = 0
+        self._lock = threading.Lock()
+
+        self.duplicates_found = 0
+
+    # Shingles de palabras de un texto (sin las etiquetas)
+    def _shingles(self, text):
+        words = self._WORDS.findall(self._LABELS.sub("", text).lower())
+        if not words:
+            return set()
+        size = min(self.shingle_size, len(words))
+        return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+    # Hashes (32 bits) de los shingles de un texto y nº de ellos que no salen
+    # de la plantilla del portal (título y ubicación)
+    def _shingle_hashes(self, text):
+        shingles = self._shingles(text)
+        template = self._shingles("\n".join(self._TEMPLATE_LINES.findall(text)))
+        return [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], len(shingles) - len(template & shingles)
+
+    # Firmas MinHash de todos los textos (una fila por texto) y si se pueden
+    # comparar (con al menos `min_shingles` shingles propios)
+    def signatures(self, texts):
+        hashes, own = zip(*(self._shingle_hashes(text) for text in texts)) if texts else ((), ())
+        lengths = np.array([len(h) for h in hashes], dtype=np.int64)
+        valid = (lengths > 0) & (np.array(own, dtype=np.int64) >= self.min_shingles)
+        present = np.flatnonzero(lengths)
+
+        signatures = np.full((len(texts), self.num_perm), self._MAX_HASH, dtype=np.uint64)
+        if len(present) == 0:
+            return signatures, valid
+
+        values = np.fromiter((x for h in hashes for x in h), dtype=np.uint64, count=int(lengths.sum()))
+        starts = np.concatenate([[0], np.cumsum(lengths[present])[:-1]])
+
+        # Una pasada vectorizada por permutación; reduceat da el mínimo de cada texto
+        for p in range(self.num_perm):
+            permuted = ((self._a[p] * values + self._b[p]) % self._MERSENNE_PRIME) & self._MAX_HASH
+            signatures[present, p] = np.minimum.reduceat(permuted, starts)
+
+        return signatures, valid
+
+    # Campos clave para comprobar que dos anuncios describen el mismo piso
+    def _key_fields(self, metadata):
+        barrio = metadata.get('barrio')
+        barrio = barrio.strip().lower() if barrio else None
+        if barrio:
+            barrio_id = self._barrio_ids.setdefault(barrio, len(self._barrio_ids))
+        return (
+            self._number(metadata.get('precio')),
+            self._number(metadata.get('metros')),
+            self._number(metadata.get('Habitaciones')),
+            float(barrio_id) if barrio else np.nan
+        ) + self._listing_key(metadata.get('url'))
+
+    # (portal, hash del id del anuncio) de una URL conocida; NaN si no lo es
+    def _listing_key(self, url):
+        if url:
+            host = urlsplit(url).netloc.lower()
+            for portal, pattern in self._LISTING_IDS.items():
+                if host == portal or host.endswith("." + portal):
+                    match = pattern.search(url)
+                    if match:
+                        # 48 bits: cabe exacto en un float64
+                        digest = hashlib.blake2b(match.group(1).encode("utf-8"), digest_size=6).digest()
+                        return float(self._PORTALS.index(portal)), float(int.from_bytes(digest, 'big'))
+        return np.nan, np.nan
+
+    @staticmethod
+    def _number(value):
+        return float(value) if value is not None else np.nan
+
+    def _compatible(self, key_a, key_b):
+        precio_a, metros_a, rooms_a, barrio_a, portal_a, listing_a = key_a
+        precio_b, metros_b, rooms_b, barrio_b, portal_b, listing_b = key_b
+
+        # Mismo portal y distinto id de anuncio: son anuncios distintos
+        if portal_a >= 0 and portal_a == portal_b and listing_a != listing_b:
+            return False
+
+        # Solo se compara lo que tienen ambos anuncios (NaN o 0 = sin dato)
+        for a, b in ((precio_a, precio_b), (metros_a, metros_b)):
+            if a > 0 and b > 0 and abs(a - b) > self.numeric_tolerance * max(a, b):
+                return False
+        if rooms_a > 0 and rooms_b > 0 and rooms_a != rooms_b:
+            return False
+        if barrio_a >= 0 and barrio_b >= 0 and barrio_a != barrio_b:
+            return False
+        return True
+
+    # Hash entero de cada banda de cada firma: matriz (textos, bandas)
+    def _band_hashes(self, signatures):
+        bands = signatures.reshape(len(signatures), self.bands, self.rows_per_band)
+        return (bands * self._band_multipliers).sum(axis=2, dtype=np.uint64)
+
+    # Representantes ya fusionados que comparten alguna banda con cada firma
+    def _merged_candidates(self, band_hashes):
+        candidates = [set() for _ in range(len(band_hashes))]
+        for band, (hashes, positions) in enumerate(self._buckets):
+            if not len(hashes):
+                continue
+            lows = np.searchsorted(hashes, band_hashes[:, band], side='left')
+            highs = np.searchsorted(hashes, band_hashes[:, band], side='right')
+            for i in np.flatnonzero(highs > lows):
+                candidates[i].update(positions[lows[i]:highs[i]].tolist())
+        return candidates
+
+    # Nuevo representante: firma, campos clave y cubos pendientes
+    def _register(self, signature, key, band_hashes):
+        if self._count == len(self._signatures):
+            capacity = max(1024, 2 * self._count)
+            self._signatures = np.resize(self._signatures, (capacity, self.num_perm))
+            self._keys = np.resize(self._keys, (capacity, self._keys.shape[1]))
+
+        position = self._count
+        self._signatures[position] = signature
+        self._keys[position] = key
+        self._count += 1
+
+        for band, band_hash in enumerate(band_hashes.tolist()):
+            self._pending[band].setdefault(band_hash, []).append(position)
+        self._pending_count += 1
+        if self._pending_count >= self._MERGE_EVERY:
+            self._merge_pending()
+
+    # Fusiona los cubos pendientes con los arrays ordenados (inserción lineal, sin reordenar todo)
+    def _merge_pending(self):
+        for band, pending in enumerate(self._pending):
+            if not pending:
+                continue
+            new_hashes = np.fromiter(
+                (band_hash for band_hash, positions in pending.items() for _ in positions),
+                dtype=np.uint64
+            )
+            new_positions = np.fromiter(
+                (position for positions in pending.values() for position in positions),
+                dtype=np.int32
+            )
+            order = np.argsort(new_hashes, kind='stable')
+            hashes, positions = self._buckets[band]
+            at = np.searchsorted(hashes, new_hashes[order], side='right')
+            self._buckets[band] = (np.insert(hashes, at, new_hashes[order]), np.insert(positions, at, new_positions[order]))
+
+        self._pending = [{} for _ in range(self.bands)]
+        self._pending_count = 0
+
+    def find_duplicates(self, texts, metadatas):
+        """
+        Devuelve, para cada texto, la posición del representante del que es
+        copia (índice dentro de esta llamada, o -1 si el representante es de
+        una llamada anterior), o None si no es un duplicado.
+        """
+        signatures, valid = self.signatures(texts)
+        signatures = signatures.astype(np.uint32)
+        duplicate_of = [None] * len(texts)
+
+        with self._lock:
+            first_new = self._count
+            # Índice (en esta llamada) de cada representante nuevo, por orden de alta
+            registered = []
+            band_hashes = self._band_hashes(signatures)
+            merged = self._merged_candidates(band_hashes)
+
+            for i in range(len(texts)):
+                # Sin texto propio suficiente no hay con qué distinguir dos anuncios
+                if not valid[i]:
+                    continue
+
+                signature = signatures[i]
+                key = self._key_fields(metadatas[i])
+
+                candidates = merged[i]
+                for band, band_hash in enumerate(band_hashes[i].tolist()):
+                    candidates.update(self._pending[band].get(band_hash, ()))
+
+                match = None
+                for candidate in sorted(candidates):
+                    similarity = np.mean(self._signatures[candidate] == signature)
+                    if similarity >= self.threshold and self._compatible(self._keys[candidate].tolist(), key):
+                        match = candidate
+                        break
+
+                if match is not None:
+                    duplicate_of[i] = registered[match - first_new] if match >= first_new else -1
+                    self.duplicates_found += 1
+                    continue
+
+                # Nuevo representante (si no se ha alcanzado el límite)
+                if self._count < self.max_representatives:
+                    registered.append(i)
+                    self._register(signature, key, band_hashes[i])
+
+        return duplicate_of
+
+    # Quitar los duplicados de un lote y enlazar sus URLs en el representante
+    def deduplicate(self, df, texts, metadatas):
+        """
+        Devuelve (df, textos, metadata) sin los casi duplicados. El
+        representante guarda 'duplicate_urls' (separadas por " | ") y
+        'duplicates_count'. Las copias de un anuncio de un bloque anterior
+        (ya guardado) solo se descartan.
+        """
+        duplicate_of = self.find_duplicates(texts, metadatas)
+
+        links = {}
+        for i, representative in enumerate(duplicate_of):
+            if representative is not None and representative >= 0 and metadatas[i].get('url'):
+                links.setdefault(representative, []).append(metadatas[i]['url'])
+
+        keep = [i for i, representative in enumerate(duplicate_of) if representative is None]
+        for representative, urls in links.items():
+            metadatas[representative]['duplicate_urls'] = " | ".join(urls)
+            metadatas[representative]['duplicates_count'] = len(urls)
+
+        removed = len(texts) - len(keep)
+        if removed:
+            print(f"- Casi duplicados descartados: {removed}")
+
+        df = df.iloc[keep] if df is not None else None
+        return df, [texts[i] for i in keep], [metadatas[i] for i in keep]
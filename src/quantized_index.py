@@ -0,0 +1,334 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from .config import Config
+
+
+class QuantizedIndex:
+    """
+    Índice vectorial compacto: en RAM solo se guarda una copia cuantizada
+    (int8 por dimensión o 1 bit por dimensión) para generar candidatos.
+    Los vectores completos (float32) quedan en disco, mapeados en memoria,
+    y solo se leen para re-puntuar los mejores candidatos.
+
+    Las distancias devueltas son L2 al cuadrado, igual que la colección
+    de ChromaDB por defecto, para que el scoring posterior no cambie.
+
+    Las bajas (`remove`) marcan la fila como borrada (deleted.bin) sin
+    reescribir los ficheros; volver a añadir el id reutiliza su fila.
+
+    Las altas escriben primero los datos y después meta.json, que es lo
+    que manda: al cargar, lo que haya en los ficheros más allá de
+    meta['count'] (un alta interrumpida) se descarta.
+    """
+
+    MODES = ('int8', 'binary')
+
+    # Nº de bits a 1 de cada byte (para distancias de Hamming)
+    _POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    # Memoria temporal máxima por bloque en la búsqueda aproximada (bytes)
+    _SCAN_BYTES = 16 * 1024 * 1024
+    # Margen al ampliar la escala int8, para no re-cuantizar en cada lote
+    _SCALE_HEADROOM = 1.25
+
+    def __init__(self, path=None, mode=None):
+        self.path = path or Config.QUANTIZED_INDEX_PATH
+        self.mode = mode or Config.VECTOR_STORAGE
+        if self.mode not in self.MODES:
+            raise ValueError(f"Modo de cuantización no soportado: '{self.mode}'. Opciones: {', '.join(self.MODES)}")
+
+        self.dim = None
+        self.scale = None
+        self.ids = []
+        self.id_to_row = {}
+        self.codes = None
+        self.deleted = np.zeros(0, dtype=bool)
+        self._vectors = None
+        # Altas y búsquedas concurrentes (ingestas en paralelo, varias sesiones)
+        self._lock = threading.RLock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    # Ancho en bytes de un vector cuantizado
+    def _code_width(self):
+        return self.dim if self.mode == 'int8' else (self.dim + 7) // 8
+
+    def _code_dtype(self):
+        return np.int8 if self.mode == 'int8' else np.uint8
+
+    def _load(self):
+        if not os.path.exists(self._file('meta.json')):
+            # Restos de un primer alta que no llegó a escribir meta.json
+            for name in ('vectors.f32', 'codes.bin', 'ids.txt', 'deleted.bin'):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            return
+
+        with open(self._file('meta.json')) as f:
+            meta = json.load(f)
+        if meta['mode'] != self.mode:
+            raise ValueError(
+                f"El índice en '{self.path}' está en modo '{meta['mode']}' y se ha pedido '{self.mode}'. "
+                f"Resetea la BD para cambiar de modo."
+            )
+
+        self.dim = meta['dim']
+        self.scale = np.array(meta['scale'], dtype=np.float32) if meta.get('scale') else None
+
+        count = meta['count']
+        with open(self._file('ids.txt'), encoding='utf-8') as f:
+            self.ids = [line.rstrip('\n') for line in f]
+        if len(self.ids) < count:
+            raise ValueError(f"El índice en '{self.path}' está corrupto: faltan ids. Resetea la BD.")
+        if len(self.ids) > count:
+            self.ids = self.ids[:count]
+            tmp_path = self._file('ids.txt.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(f"{id_}\n" for id_ in self.ids)
+            os.replace(tmp_path, self._file('ids.txt'))
+        self.id_to_row = {id_: row for row, id_ in enumerate(self.ids)}
+
+        self._truncate('vectors.f32', count * self.dim * 4)
+        self._truncate('codes.bin', count * self._code_width())
+
+        # Los códigos compactos se cargan en RAM: son lo que se recorre en cada consulta
+        self.codes = np.fromfile(self._file('codes.bin'), dtype=self._code_dtype()).reshape(-1, self._code_width())
+        self._load_deleted()
+        self._open_vectors()
+
+    # Descarta lo escrito más allá de meta['count'] (alta interrumpida antes de meta.json)
+    def _truncate(self, name, size):
+        if os.path.getsize(self._file(name)) < size:
+            raise ValueError(f"El índice en '{self.path}' está corrupto: '{name}' incompleto. Resetea la BD.")
+        if os.path.getsize(self._file(name)) > size:
+            os.truncate(self._file(name), size)
+
+    # Marcas de filas borradas (las filas añadidas después no tienen marca en el fichero)
+    def _load_deleted(self):
+        self.deleted = np.zeros(self.count, dtype=bool)
+        if os.path.exists(self._file('deleted.bin')):
+            marks = np.fromfile(self._file('deleted.bin'), dtype=bool)[:self.count]
+            self.deleted[:len(marks)] = marks
+
+    def _save_deleted(self):
+        tmp_path = self._file('deleted.bin.tmp')
+        self.deleted.tofile(tmp_path)
+        os.replace(tmp_path, self._file('deleted.bin'))
+
+    def _open_vectors(self):
+        self._vectors = None
+        if self.count:
+            self._vectors = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r', shape=(self.count, self.dim))
+
+    def _save_meta(self):
+        meta = {
+            'mode': self.mode,
+            'dim': self.dim,
+            'count': self.count,
+            'scale': self.scale.tolist() if self.scale is not None else None
+        }
+        # Se escribe aparte y se sustituye: meta.json nunca queda a medias
+        tmp_path = self._file('meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file('meta.json'))
+
+    # Añade bytes al final de un fichero y los lleva a disco antes de seguir
+    def _append(self, name, data):
+        with open(self._file(name), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Filas por bloque: su copia float32 (int8) o su XOR con la consulta (binario) caben en _SCAN_BYTES
+    def _scan_rows(self):
+        row_bytes = self.dim * 4 if self.mode == 'int8' else self._code_width()
+        return max(1, self._SCAN_BYTES // row_bytes)
+
+    def _quantize(self, matrix):
+        if self.mode == 'int8':
+            return np.clip(np.round(matrix / self.scale), -127, 127).astype(np.int8)
+        return np.packbits(matrix > 0, axis=1)
+
+    # Añade (o sobrescribe, si el id ya existe) vectores al índice
+    def add(self, ids, embeddings):
+        with self._lock:
+            self._add(ids, embeddings)
+
+    def _add(self, ids, embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or len(matrix) == 0:
+            return
+
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+            if self.mode == 'int8':
+                # Escala simétrica por dimensión, a partir del primer lote
+                self.scale = np.maximum(np.abs(matrix).max(axis=0), 1e-6) / 127
+            self.codes = np.empty((0, self._code_width()), dtype=self._code_dtype())
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"El índice guarda vectores de {self.dim} dimensiones y se han recibido de {matrix.shape[1]}.")
+        elif self.mode == 'int8':
+            # Valores fuera del rango de la escala: se saturarían, así que se amplía
+            peak = np.abs(matrix).max(axis=0) / 127
+            if (peak > self.scale).any():
+                self._requantize(np.maximum(self.scale, peak * self._SCALE_HEADROOM))
+
+        codes = self._quantize(matrix)
+
+        existing = [(i, self.id_to_row[id_]) for i, id_ in enumerate(ids) if id_ in self.id_to_row]
+        new = [i for i, id_ in enumerate(ids) if id_ not in self.id_to_row]
+
+        # Sobrescribir filas existentes en su sitio
+        if existing:
+            positions = np.array([i for i, _ in existing])
+            rows = np.array([row for _, row in existing])
+            self._vectors = None
+            vectors = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r+', shape=(self.count, self.dim))
+            vectors[rows] = matrix[positions]
+            vectors.flush()
+            del vectors
+
+            self.codes[rows] = codes[positions]
+            on_disk = np.memmap(self._file('codes.bin'), dtype=self._code_dtype(), mode='r+', shape=self.codes.shape)
+            on_disk[rows] = codes[positions]
+            on_disk.flush()
+            del on_disk
+
+            # Un id borrado que vuelve a añadirse recupera su fila
+            if self.deleted[rows].any():
+                self.deleted[rows] = False
+                self._save_deleted()
+
+        # Añadir filas nuevas al final de los ficheros (meta.json, que fija el nº de filas, va después)
+        if new:
+            new = np.array(new)
+            self._append('vectors.f32', matrix[new].tobytes())
+            self._append('codes.bin', codes[new].tobytes())
+            self._append('ids.txt', "".join(f"{ids[i]}\n" for i in new).encode('utf-8'))
+
+            for i in new:
+                self.id_to_row[ids[i]] = len(self.ids)
+                self.ids.append(ids[i])
+            self.codes = np.concatenate([self.codes, codes[new]])
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(new), dtype=bool)])
+
+        self._save_meta()
+        self._open_vectors()
+
+    # Da de baja ids (p. ej. trozos que una propiedad ya no tiene): no vuelven a salir en search()
+    def remove(self, ids):
+        with self._lock:
+            rows = [self.id_to_row[id_] for id_ in ids if id_ in self.id_to_row]
+            if rows and not self.deleted[rows].all():
+                self.deleted[rows] = True
+                self._save_deleted()
+
+    # Cambia la escala int8 y re-cuantiza los códigos guardados desde los vectores completos
+    def _requantize(self, scale):
+        self.scale = scale.astype(np.float32)
+        if not self.count:
+            return
+
+        codes = np.empty_like(self.codes)
+        for start in range(0, self.count, self._scan_rows()):
+            block = np.asarray(self._vectors[start:start + self._scan_rows()])
+            codes[start:start + len(block)] = self._quantize(block)
+
+        tmp_path = self._file('codes.bin.tmp')
+        codes.tofile(tmp_path)
+        os.replace(tmp_path, self._file('codes.bin'))
+        self.codes = codes
+        self._save_meta()
+
+    # Puntuación aproximada (mayor = más parecido) de todas las filas
+    def _approximate_scores(self, query):
+        scores = np.empty(self.count, dtype=np.float32)
+
+        scan_rows = self._scan_rows()
+        if self.mode == 'int8':
+            scaled_query = query * self.scale
+            for start in range(0, self.count, scan_rows):
+                block = self.codes[start:start + scan_rows]
+                scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        else:
+            query_bits = np.packbits(query > 0)
+            for start in range(0, self.count, scan_rows):
+                block = self.codes[start:start + scan_rows]
+                hamming = self._POPCOUNT[block ^ query_bits].sum(axis=1, dtype=np.int32)
+                scores[start:start + len(block)] = -hamming
+
+        return scores
+
+    def search(self, query_embedding, n_results, rescore_factor=None, allowed_ids=None):
+        """
+        Devuelve (ids, distancias) de los `n_results` vecinos más cercanos.
+        Los candidatos salen del índice cuantizado y se re-puntúan con los
+        vectores completos. `allowed_ids` restringe la búsqueda a esos ids.
+        """
+        with self._lock:
+            return self._search(query_embedding, n_results, rescore_factor, allowed_ids)
+
+    def _search(self, query_embedding, n_results, rescore_factor=None, allowed_ids=None):
+        if not self.count:
+            return [], []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        rescore_factor = rescore_factor or Config.QUANTIZED_RESCORE_FACTOR
+
+        scores = self._approximate_scores(query)
+        if allowed_ids is not None:
+            mask = np.zeros(self.count, dtype=bool)
+            rows = [self.id_to_row[id_] for id_ in allowed_ids if id_ in self.id_to_row]
+            mask[rows] = True
+            mask &= ~self.deleted
+            scores[~mask] = -np.inf
+            available = int(mask.sum())
+        else:
+            scores[self.deleted] = -np.inf
+            available = self.count - int(self.deleted.sum())
+
+        n_candidates = min(available, n_results * rescore_factor)
+        if n_candidates == 0:
+            return [], []
+
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        candidates.sort()  # Lectura secuencial del fichero mapeado
+
+        # Re-puntuación exacta: L2 al cuadrado con los vectores completos
+        vectors = np.asarray(self._vectors[candidates])
+        distances = (vectors * vectors).sum(axis=1) + query @ query - 2 * (vectors @ query)
+
+        order = np.argsort(distances, kind='stable')[:n_results]
+        return [self.ids[candidates[i]] for i in order], distances[order].tolist()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._vectors = None
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path, exist_ok=True)
+        self.dim = None
+        self.scale = None
+        self.ids = []
+        self.id_to_row = {}
+        self.codes = None
+        self.deleted = np.zeros(0, dtype=bool)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .config import Config
+from .embedding_cache import EmbeddingCache
+
+
+class QueryEmbeddingCache:
+    """
+    Caché LRU con TTL para embeddings de consultas, en memoria del proceso.
+    Opcionalmente vuelca las entradas a disco (EmbeddingCache) para que
+    sobrevivan a los reinicios de Streamlit.
+    """
+
+    def __init__(self, capacity=None, ttl_seconds=None, disk_path=None):
+        self.capacity = capacity or Config.QUERY_CACHE_CAPACITY
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.QUERY_CACHE_TTL_SECONDS
+        disk_path = disk_path if disk_path is not None else Config.QUERY_CACHE_DISK_PATH
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = EmbeddingCache(path=disk_path, max_entries=Config.QUERY_CACHE_DISK_MAX_ENTRIES) if disk_path else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Normalizamos la consulta para que variantes triviales compartan entrada
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def get(self, query, model):
+        key = (model, self.normalize(query))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                embedding, stored_at = entry
+                if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+
+        if self.disk:
+            # El TTL también vale para lo volcado a disco (cuenta desde que se escribió)
+            if self.ttl_seconds:
+                found = self.disk.get_many_fresh(model, [key[1]], self.ttl_seconds)
+            else:
+                found = {i: (embedding, time.time()) for i, embedding in self.disk.get_many(model, [key[1]]).items()}
+            if found:
+                embedding, stored_at = found[0]
+                self._store(key, embedding, stored_at)
+                with self._lock:
+                    self.disk_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query, model, embedding):
+        key = (model, self.normalize(query))
+        self._store(key, embedding)
+        if self.disk:
+            self.disk.put_many(model, [key[1]], [embedding])
+
+    def _store(self, key, embedding, stored_at=None):
+        with self._lock:
+            self._entries[key] = (embedding, stored_at or time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'disk_entries': self.disk.stats()['entries'] if self.disk else 0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk:
+            self.disk.clear()
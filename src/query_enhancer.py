@@ -12,13 +12,19 @@ class QueryEnhancer:
     """
 
     def __init__(self):
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+        # Sin clave (p. ej. backend de embeddings local/offline) no hay análisis LLM:
+        # las consultas se buscan tal cual
+        self.client = OpenAI(api_key=Config.OPENAI_API_KEY) if Config.OPENAI_API_KEY else None
+        if self.client is None:
+            print("[Aviso] OPENAI_API_KEY no configurada: consultas sin análisis LLM")
 
     def parse_query_to_json(self, user_query):
         """
         Convierte consulta natural en JSON estructurado con información
         para búsqueda semántica y filtros exactos
         """
+        if self.client is None:
+            return self._simple_query(user_query)
 
         system_prompt = """Eres un experto en análisis de consultas inmobiliarias. Extrae información estructurada de consultas de usuarios y devuelve un JSON con la siguiente estructura:
 
@@ -134,16 +140,20 @@ IMPORTANTE: Devuelve ÚNICAMENTE el objeto JSON válido, sin texto explicativo,
 
         except Exception as e:
             print(f"Error al procesar query con LLM: {e}")
-            # Fallback a query simple
-            return {
-                "semantic_query": user_query,
-                "filters": {},
-                "preferences": {
-                    "estilo_vida": [],
-                    "caracteristicas_deseadas": [],
-                    "ubicacion_tipo": None,
-                },
-            }
+            return self._simple_query(user_query)
+
+    # Fallback a query simple (sin filtros ni preferencias)
+    @staticmethod
+    def _simple_query(user_query):
+        return {
+            "semantic_query": user_query,
+            "filters": {},
+            "preferences": {
+                "estilo_vida": [],
+                "caracteristicas_deseadas": [],
+                "ubicacion_tipo": None,
+            },
+        }
 
     def _validate_parsed_query(self, parsed_query):
         """Valida que el JSON tenga la estructura correcta"""
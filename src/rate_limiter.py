@@ -0,0 +1,52 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket doble (peticiones/minuto y tokens/minuto) compartido entre hilos.
+    Cada llamada a la API reserva 1 petición y sus tokens estimados antes de salir.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+
+        self._request_allowance = min(
+            self.requests_per_minute,
+            self._request_allowance + elapsed * self.requests_per_minute / 60
+        )
+        self._token_allowance = min(
+            self.tokens_per_minute,
+            self._token_allowance + elapsed * self.tokens_per_minute / 60
+        )
+
+    # Bloquea hasta que haya capacidad para una petición con `tokens` tokens
+    def acquire(self, tokens=1):
+        # Un lote mayor que el límite por minuto nunca cabría: lo acotamos
+        tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self._request_allowance >= 1 and self._token_allowance >= tokens:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+
+                wait = max(
+                    (1 - self._request_allowance) * 60 / self.requests_per_minute,
+                    (tokens - self._token_allowance) * 60 / self.tokens_per_minute
+                )
+
+            time.sleep(max(wait, 0.01))
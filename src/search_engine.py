@@ -1,7 +1,14 @@
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+import numpy as np
 import pandas as pd
 from .embeddings_manager import EmbeddingsManager
 from .database_manager import DatabaseManager
 from .query_enhancer import QueryEnhancer
+from .query_cache import QueryEmbeddingCache
 from .config import Config
 
 class PropertySearchEngine:
@@ -11,6 +18,21 @@ class PropertySearchEngine:
         self.db_manager = DatabaseManager()
         self.collection = self.db_manager.get_or_create_collection()
         self.query_enhancer = QueryEnhancer()
+        self.query_cache = QueryEmbeddingCache()
+
+        # Rondas de sobre-recuperación de la última búsqueda (ver _fetch_filtered)
+        # y, tras search_many, las de cada consulta del lote
+        self.last_search_stats = {}
+        self.last_batch_stats = []
+
+        # Análisis LLM de speculative_search (los que superan el plazo terminan aquí sin bloquear)
+        self._llm_executor = ThreadPoolExecutor(max_workers=4)
+        self.last_query_info = None
+
+        # Bbdd cargada antes de tener índice léxico: se construye una vez desde la colección
+        lexical_index = self.db_manager.lexical_index
+        if lexical_index is not None and lexical_index.count == 0 and self.collection.count() > 0:
+            self.db_manager.rebuild_lexical_index()
 
         # Mapeo de terminos para fallback (si LLM falla)
         self.query_mapping = {
@@ -36,6 +58,23 @@ class PropertySearchEngine:
         
         return enhanced
     
+    # Embedding de la query semántica, reutilizando la caché si ya se calculó
+    def get_query_embedding(self, semantic_query):
+        model = self.embeddings_manager.get_model_name(use_large_model=True)
+        embedding = self.query_cache.get(semantic_query, model)
+        if embedding is None:
+            model_used, embedding = self.embeddings_manager.generate_embedding_with_model(
+                semantic_query, use_large_model=True
+            )
+            # Un vector del modelo de respaldo no se guarda bajo la clave del modelo grande
+            if model_used == model:
+                self.query_cache.put(semantic_query, model, embedding)
+        return embedding
+
+    # Estadísticas de la caché de consultas (para dimensionarla)
+    def get_query_cache_stats(self):
+        return self.query_cache.stats()
+
     # Calcular puntuación mejorada con metadata estructurada
     def calculate_relevance_score(self, doc, meta, distance, query):
         # Score semántico base
@@ -69,6 +108,62 @@ class PropertySearchEngine:
         )
 
         return min(1.0, max(0, final_score))  # Normalizar entre 0-1
+
+    @staticmethod
+    def score_candidates(metadatas, distances):
+        """
+        Versión vectorizada de calculate_relevance_score: puntúa todos los
+        candidatos de una vez con arrays de NumPy (mismos pesos y mismo
+        orden de operaciones, por lo que los scores son idénticos).
+        """
+        if not metadatas:
+            return np.zeros(0)
+
+        def present(field):
+            return np.array([(meta.get(field) or 0) > 0 for meta in metadatas])
+
+        def located(field):
+            return np.array([bool(meta.get(field)) and meta[field] != 'No especificado' for meta in metadatas])
+
+        semantic_score = np.maximum(0, 1 - np.asarray(distances, dtype=float))
+        completeness_score = np.array([meta.get('completeness_score', 0.5) for meta in metadatas], dtype=float)
+
+        critical_bonus = (np.where(present('precio'), 0.15, 0.0)
+                          + np.where(present('Habitaciones'), 0.10, 0.0)
+                          + np.where(present('metros'), 0.10, 0.0))
+        location_bonus = np.where(located('barrio'), 0.05, 0.0) + np.where(located('distrito'), 0.05, 0.0)
+
+        final_score = semantic_score * 0.6 + completeness_score * 0.2 + critical_bonus + location_bonus
+        return np.clip(final_score, 0, 1.0)
+
+    def rank_candidates(self, candidates, n_results):
+        """
+        Puntúa los candidatos (documento, metadata, distancia), los ordena
+        por relevancia (orden estable) y elimina duplicados por URL.
+        """
+        if not candidates:
+            return []
+
+        docs, metadatas, distances = zip(*candidates)
+        scores = self.score_candidates(metadatas, distances)
+
+        unique_results = []
+        seen_urls = set()
+        for i in np.argsort(-scores, kind='stable'):
+            url = metadatas[i].get('url', '')
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+            unique_results.append({
+                'document': docs[i],
+                'metadata': metadatas[i],
+                'distance': distances[i],
+                'relevance_score': float(scores[i])
+            })
+            if len(unique_results) == n_results:
+                break
+
+        return unique_results
     
     # Buscar propiedades con análisis LLM y filtros estructurados
     def search(self, query, n_results=None):
@@ -82,59 +177,407 @@ class PropertySearchEngine:
         filters = query_info['filters']
 
         # 2. Generar embedding de la query semántica mejorada
-        query_embedding = self.embeddings_manager.generate_embedding(semantic_query, use_large_model=True)
+        try:
+            query_embedding = self.get_query_embedding(semantic_query)
+        except Exception as e:
+            return self._lexical_fallback(query, filters, n_results, e)
+        self.db_manager.check_embedding_dimensions(len(query_embedding))
+
+        # 3-7. Recuperar, filtrar y ordenar (fusionando con BM25 sobre la consulta original)
+        return self._search_embedding(query_embedding, filters, n_results, lexical_query=query)
+
+    def speculative_search(self, query, n_results=None, deadline=None, show_analysis=True):
+        """
+        Búsqueda interactiva con menor latencia: mientras el LLM analiza la
+        consulta, se embebe y se recupera la consulta original. Si la query
+        semántica conserva casi todas sus palabras, se reutilizan esos
+        candidatos (aplicando los filtros); si no, se refina con la query
+        semántica como en search(). Si el LLM no responde en `deadline`
+        segundos se devuelven los resultados de la consulta original. El
+        análisis usado queda en last_query_info (None si no llegó a tiempo).
+        """
+        if n_results is None:
+            n_results = Config.DEFAULT_RESULTS
+        if deadline is None:
+            deadline = Config.SEARCH_LLM_DEADLINE
+        start = time.time()
+
+        # 1. Analizar consulta con LLM en segundo plano
+        llm_future = self._llm_executor.submit(self.query_enhancer.get_enhanced_query_info, query, show_analysis)
 
-        # 3. Buscar en ChromaDB (más resultados para luego filtrar)
+        # 2. Mientras tanto, embedding y recuperación de la consulta original
         search_results = min(n_results * 3, 30)
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=search_results,
-            include=["documents", "metadatas", "distances"]
-        )
+        try:
+            raw_embedding = self.get_query_embedding(query)
+        except Exception as e:
+            # Sin embeddings: filtros del LLM (si llega a tiempo) y solo BM25
+            try:
+                query_info = llm_future.result(timeout=max(0, deadline - (time.time() - start)))
+            except FuturesTimeoutError:
+                query_info = None
+            self.last_query_info = query_info
+            return self._lexical_fallback(query, query_info['filters'] if query_info else {}, n_results, e)
+        self.db_manager.check_embedding_dimensions(len(raw_embedding))
+        raw_results = self._query(raw_embedding, search_results)
+
+        # 3. Esperar al LLM como mucho hasta el plazo
+        try:
+            query_info = llm_future.result(timeout=max(0, deadline - (time.time() - start)))
+        except FuturesTimeoutError:
+            print(f"⚠️  El análisis LLM superó el plazo ({deadline}s), resultados de la consulta original")
+            self.last_query_info = None
+            candidates = self._strict_results(raw_results, {})
+            self.last_search_stats = {'rounds': 1, 'candidates': search_results, 'selectivity': None,
+                                      'pushdown': False, 'strict_results': len(candidates), 'speculative': 'timeout'}
+            return self._rank_hybrid(candidates, {}, n_results, query)
+
+        self.last_query_info = query_info
+        semantic_query = query_info['semantic_query']
+        filters = query_info['filters']
+        overlap = self._word_overlap(query, semantic_query)
+
+        if overlap >= Config.SPECULATIVE_REUSE_OVERLAP:
+            # 4a. Reutilizar los candidatos de la consulta original si bastan con los filtros
+            candidates = self._strict_results(raw_results, filters)
+            if len(candidates) >= n_results or not filters:
+                results = self._rank_hybrid(candidates, filters, n_results, query)
+                self.last_search_stats = {'rounds': 1, 'candidates': search_results, 'selectivity': None,
+                                          'pushdown': False, 'strict_results': len(candidates)}
+            else:
+                results = self._search_embedding(raw_embedding, filters, n_results, lexical_query=query)
+            mode = 'reused'
+        else:
+            # 4b. Refinar con la query semántica
+            try:
+                query_embedding = self.get_query_embedding(semantic_query)
+            except Exception as e:
+                return self._lexical_fallback(query, filters, n_results, e)
+            results = self._search_embedding(query_embedding, filters, n_results, lexical_query=query)
+            mode = 'refined'
+
+        self.last_search_stats.update({'speculative': mode, 'overlap': round(overlap, 2)})
+        return results
+
+    # Fracción de palabras de la consulta original presentes en la query semántica
+    @staticmethod
+    def _word_overlap(query, semantic_query):
+        words = set(re.findall(r"\w+", query.lower()))
+        if not words:
+            return 0.0
+        return len(words & set(re.findall(r"\w+", semantic_query.lower()))) / len(words)
 
-        if not results['documents'][0]:
+    def search_many(self, queries, n_results=None, max_workers=None):
+        """
+        Búsqueda por lotes (búsquedas guardadas, evaluaciones offline). Las
+        consultas se analizan con el LLM en paralelo, las queries semánticas
+        se embeben en una sola petición y se lanza una única consulta a la
+        bbdd por cada filtro distinto (todas las consultas sin filtros van
+        juntas). Devuelve una lista de resultados por consulta, en el orden
+        de entrada, iguales a los de search().
+        """
+        if n_results is None:
+            n_results = Config.DEFAULT_RESULTS
+
+        queries = list(queries)
+        self.last_batch_stats = []
+        if not queries:
             return []
 
-        # 4. Aplicar filtros estructurados
-        filtered_results = []
-        for doc, meta, distance in zip(results['documents'][0], results['metadatas'][0], results['distances'][0]):
-            if self._apply_filters(meta, filters):
-                score = self.calculate_relevance_score(doc, meta, distance, query)
-                filtered_results.append({
-                    'document': doc,
-                    'metadata': meta,
-                    'distance': distance,
-                    'relevance_score': score
-                })
+        # 1. Analizar las consultas con el LLM en paralelo
+        max_workers = min(len(queries), max_workers or Config.SEARCH_BATCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            query_infos = list(executor.map(
+                lambda query: self.query_enhancer.get_enhanced_query_info(query, show_analysis=False), queries
+            ))
+
+        # 2. Embeddings de todas las queries semánticas en una sola petición
+        try:
+            query_embeddings = self.get_query_embeddings([info['semantic_query'] for info in query_infos])
+        except Exception as e:
+            all_results = []
+            for query, info in zip(queries, query_infos):
+                all_results.append(self._lexical_fallback(query, info['filters'], n_results, e))
+                self.last_batch_stats.append(self.last_search_stats)
+            return all_results
+        self.db_manager.check_embedding_dimensions(len(query_embeddings[0]))
+
+        # 3. Primera ronda: una consulta a la bbdd por cada (filtro, k) distinto
+        search_results = min(n_results * 3, 30)
+        plans = [self._plan_fetch(info['filters'], n_results, search_results) for info in query_infos]
+        groups = {}
+        for i, plan in enumerate(plans):
+            groups.setdefault((json.dumps(plan['where'], sort_keys=True), plan['k']), []).append(i)
+
+        first_results = [None] * len(queries)
+        for (_, k), positions in groups.items():
+            batch = self._query_many([query_embeddings[i] for i in positions], k, plans[positions[0]]['where'])
+            for i, results in zip(positions, batch):
+                first_results[i] = results
+
+        # 4-7. Filtrar (ampliando k si hace falta), relajar y ordenar cada consulta
+        all_results = []
+        for i, info in enumerate(query_infos):
+            all_results.append(self._search_embedding(
+                query_embeddings[i], info['filters'], n_results, plans[i], first_results[i], lexical_query=queries[i]
+            ))
+            self.last_batch_stats.append(self.last_search_stats)
+
+        return all_results
+
+    # Embeddings de varias queries semánticas: caché primero, el resto en un solo lote
+    def get_query_embeddings(self, semantic_queries):
+        model = self.embeddings_manager.get_model_name(use_large_model=True)
+        embeddings = [self.query_cache.get(query, model) for query in semantic_queries]
+
+        missing = list(dict.fromkeys(q for q, e in zip(semantic_queries, embeddings) if e is None))
+        if missing:
+            usage = {}
+            computed = dict(zip(missing, self.embeddings_manager.generate_embeddings_batch(
+                missing, use_large_model=True, usage=usage
+            )))
+            fallback = {missing[i] for i in usage.get('fallback', [])}
+            for query, embedding in computed.items():
+                if query not in fallback:
+                    self.query_cache.put(query, model, embedding)
+            embeddings = [e if e is not None else computed[q] for q, e in zip(semantic_queries, embeddings)]
+
+        return embeddings
+
+    # Pasos 3-7 de la búsqueda a partir del embedding de la consulta
+    def _search_embedding(self, query_embedding, filters, n_results, plan=None, first_results=None,
+                          lexical_query=None):
+        # 3-4. Buscar en ChromaDB y aplicar filtros estructurados, ampliando k si hacen falta más
+        search_results = min(n_results * 3, 30)
+        if plan is None:
+            plan = self._plan_fetch(filters, n_results, search_results)
+        results, candidates = self._fetch_filtered(query_embedding, filters, n_results, plan, first_results)
+
+        if not results['documents'][0] and not filters:
+            return []
 
         # 5. Si hay pocos resultados con filtros, relajar filtros
-        if len(filtered_results) < n_results and filters:
-            print(f"⚠️  Solo {len(filtered_results)} resultados con filtros estrictos, relajando criterios...")
+        if len(candidates) < n_results and filters:
+            print(f"⚠️  Solo {len(candidates)} resultados con filtros estrictos, relajando criterios...")
             # Buscar sin filtros estrictos
+            # (la última consulta llevaba el filtro en el 'where' o un k ampliado)
+            if self.last_search_stats['pushdown'] or self.last_search_stats['candidates'] != search_results:
+                results = self._query(query_embedding, search_results)
+            seen_urls = {meta.get('url') for _, meta, _ in candidates}
             for doc, meta, distance in zip(results['documents'][0], results['metadatas'][0], results['distances'][0]):
-                if not any(result['metadata'].get('url') == meta.get('url') for result in filtered_results):
-                    score = self.calculate_relevance_score(doc, meta, distance, query)
-                    filtered_results.append({
-                        'document': doc,
-                        'metadata': meta,
-                        'distance': distance,
-                        'relevance_score': score
-                    })
-
-        # 6. Ordenar por relevancia
-        filtered_results.sort(key=lambda x: x['relevance_score'], reverse=True)
-
-        # 7. Eliminar duplicados por URL
-        unique_results = []
-        seen_urls = set()
+                if meta.get('url') not in seen_urls:
+                    seen_urls.add(meta.get('url'))
+                    candidates.append((doc, meta, distance))
+
+        # 6-7. Puntuar, ordenar por relevancia y eliminar duplicados por URL
+        return self._rank_hybrid(candidates, filters, n_results, lexical_query)
+
+    def _lexical_available(self):
+        lexical_index = self.db_manager.lexical_index
+        return Config.HYBRID_SEARCH and lexical_index is not None and lexical_index.count > 0
+
+    # Ranking final: vectorial, o fusionado por RRF con BM25 si la búsqueda híbrida está activa
+    def _rank_hybrid(self, candidates, filters, n_results, lexical_query=None):
+        if not lexical_query or not self._lexical_available():
+            return self.rank_candidates(candidates, n_results)
+
+        vector_ranked = self.rank_candidates(candidates, len(candidates))
+        lexical_ranked = self._lexical_results(lexical_query, filters, min(n_results * 3, 30))
+        return self.fuse_results([vector_ranked, lexical_ranked], n_results)
+
+    def _lexical_results(self, query_text, filters, n_results, relax=False):
+        """
+        Resultados BM25 que cumplen los filtros, en orden léxico (con
+        `relax`, completados con los que no los cumplen si no llegan a
+        n_results). Sin distancia semántica: su relevance_score solo
+        refleja completitud y datos clave (semantic_score = 0).
+        """
+        results = self.db_manager.lexical_query(query_text, n_results)
+        hits = list(zip(results['documents'][0], results['metadatas'][0], results['scores'][0]))
+
+        selected = [hit for hit in hits if self._apply_filters(hit[1], filters)]
+        if relax and filters and len(selected) < n_results:
+            selected += [hit for hit in hits if not self._apply_filters(hit[1], filters)]
+
+        metadatas = [meta for _, meta, _ in selected]
+        scores = self.score_candidates(metadatas, [1.0] * len(selected))
+        return [
+            {'document': doc, 'metadata': meta, 'distance': None, 'relevance_score': float(score), 'bm25_score': bm25}
+            for (doc, meta, bm25), score in zip(selected, scores)
+        ]
+
+    @staticmethod
+    def fuse_results(rankings, n_results):
+        """
+        Reciprocal rank fusion: cada lista aporta 1 / (Config.RRF_K + posición)
+        a cada propiedad (por URL). Ante empate se mantiene el orden de
+        aparición, con las listas en el orden recibido. Cada resultado
+        conserva el diccionario de la primera lista en que aparece y añade
+        'fusion_score'.
+        """
+        fused = {}
+        for ranking in rankings:
+            for position, result in enumerate(ranking, 1):
+                url = result['metadata'].get('url', '')
+                if url not in fused:
+                    fused[url] = {**result, 'fusion_score': 0.0}
+                fused[url]['fusion_score'] += 1 / (Config.RRF_K + position)
+
+        return sorted(fused.values(), key=lambda result: result['fusion_score'], reverse=True)[:n_results]
+
+    # Sin embeddings (p. ej. API caída): solo resultados del índice léxico
+    def _lexical_fallback(self, query, filters, n_results, error):
+        if not self._lexical_available():
+            raise error
+
+        print(f"⚠️  Embeddings no disponibles ({error}), búsqueda solo léxica (BM25)")
+        results = self._lexical_results(query, filters, min(n_results * 3, 30), relax=True)
+        self.last_search_stats = {'rounds': 0, 'candidates': 0, 'selectivity': None, 'pushdown': False,
+                                  'strict_results': sum(self._apply_filters(r['metadata'], filters) for r in results),
+                                  'lexical_only': True}
+        return self.fuse_results([results], n_results)
+
+    # Candidatos (documento, metadata, distancia) que cumplen los filtros
+    def _strict_results(self, results, filters):
+        return [
+            (doc, meta, distance)
+            for doc, meta, distance in zip(results['documents'][0], results['metadatas'][0], results['distances'][0])
+            if self._apply_filters(meta, filters)
+        ]
 
-        for result in filtered_results:
-            url = result['metadata'].get('url', '')
-            if url not in seen_urls:
-                seen_urls.add(url)
-                unique_results.append(result)
+    def _plan_fetch(self, filters, n_results, k):
+        """
+        Prepara la recuperación filtrada: 'where' y k inicial. La
+        selectividad de los filtros se estima sobre una muestra de metadata
+        en caché: el 'where' de ChromaDB cuesta más cuanto menos selectivo
+        es el filtro, así que solo se empuja cuando post-filtrar necesitaría
+        más de Config.SEARCH_MAX_CANDIDATES candidatos; si no, el k inicial
+        se amplía para que la primera ronda ya traiga unos n_results que
+        cumplan los filtros.
+        """
+        where = self.build_where(filters) if Config.FILTER_PUSHDOWN else None
+        ceiling = max(k, Config.SEARCH_MAX_CANDIDATES)
 
-        return unique_results[:n_results]
+        selectivity = None
+        if filters:
+            sample = self.db_manager.sample_metadatas()
+            if sample:
+                selectivity = sum(self._apply_filters(meta, filters) for meta in sample) / len(sample)
+
+        if where is not None and selectivity and n_results / selectivity <= ceiling:
+            where = None
+        if where is None and selectivity:
+            k = min(max(k, int(n_results / selectivity)), ceiling)
+
+        return {'where': where, 'k': k, 'ceiling': ceiling, 'selectivity': selectivity}
+
+    def _fetch_filtered(self, query_embedding, filters, n_results, plan, first_results=None):
+        """
+        Recupera candidatos y se queda con los que cumplen los filtros. Si no
+        llegan a n_results, repite la consulta con k multiplicado por
+        Config.SEARCH_GROWTH_FACTOR hasta Config.SEARCH_MAX_CANDIDATES o
+        hasta que la bbdd devuelve menos registros de los pedidos (no quedan
+        más que cumplan el 'where'). `first_results` es la primera ronda ya
+        consultada (search_many). Las rondas quedan en last_search_stats.
+        """
+        k = plan['k']
+        # Con chunking, _query pide CHUNK_OVERFETCH trozos por propiedad
+        scale = Config.CHUNK_OVERFETCH if Config.CHUNKING_ENABLED else 1
+
+        stats = {'rounds': 0, 'candidates': 0, 'selectivity': plan['selectivity'], 'pushdown': plan['where'] is not None}
+        self.last_search_stats = stats
+
+        while True:
+            if first_results is not None and stats['rounds'] == 0:
+                results = first_results
+            else:
+                results = self._query(query_embedding, k, plan['where'])
+            candidates = self._strict_results(results, filters)
+            stats['rounds'] += 1
+            stats['candidates'] = k
+
+            exhausted = results.get('fetched', len(results['documents'][0])) < k * scale
+            if len(candidates) >= n_results or not filters or k >= plan['ceiling'] or exhausted:
+                break
+            k = min(k * Config.SEARCH_GROWTH_FACTOR, plan['ceiling'])
+
+        stats['strict_results'] = len(candidates)
+        return results, candidates
+
+    # Consulta a la bbdd (agregando trozos si hay chunking)
+    def _query(self, query_embedding, n_results, where=None):
+        return self._query_many([query_embedding], n_results, where)[0]
+
+    # Varias consultas con el mismo filtro en una sola llamada a la bbdd
+    def _query_many(self, query_embeddings, n_results, where=None):
+        if Config.CHUNKING_ENABLED:
+            # Varios trozos pueden ser de la misma propiedad: pedimos más y agregamos
+            batch = self.db_manager.query_many(query_embeddings, n_results * Config.CHUNK_OVERFETCH, where=where)
+            return [self._aggregate_chunks(results) for results in batch]
+        return self.db_manager.query_many(query_embeddings, n_results, where=where)
+
+    def build_where(self, filters):
+        """
+        Traduce los filtros numéricos del QueryEnhancer a un 'where' de
+        ChromaDB: rangos de precio y metros e igualdad de habitaciones.
+        tipo/localidad se comparan por subcadena (ver _apply_filters), que
+        el 'where' no admite, y se quedan como post-filtro. A diferencia de
+        _apply_filters, una propiedad sin el campo no cumple el filtro.
+        Devuelve None si no hay nada que filtrar.
+        """
+        if not filters:
+            return None
+
+        conditions = []
+        ranges = [
+            ('precio_min', 'precio', '$gte'),
+            ('precio_max', 'precio', '$lte'),
+            ('metros_min', 'metros', '$gte'),
+            ('metros_max', 'metros', '$lte'),
+        ]
+        for key, field, operator in ranges:
+            if key in filters:
+                conditions.append({field: {operator: float(filters[key])}})
+
+        if 'habitaciones' in filters:
+            conditions.append({'Habitaciones': {'$eq': float(filters['habitaciones'])}})
+
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+    def _aggregate_chunks(self, results):
+        """
+        Agrupa los trozos recuperados por propiedad. La distancia de cada
+        propiedad es la de su mejor trozo ('max') o 1 - media de las k mejores
+        similitudes ('sum_top_k', equivalente en ranking a sumarlas).
+        """
+        groups = {}
+        for doc, meta, distance in zip(results['documents'][0], results['metadatas'][0], results['distances'][0]):
+            property_id = meta.get('property_id', meta.get('url', doc))
+            group = groups.setdefault(property_id, {'metadata': meta, 'distances': []})
+            group['distances'].append(distance)
+
+        k = Config.CHUNK_TOP_K
+        aggregated = []
+        for property_id, group in groups.items():
+            if Config.CHUNK_AGGREGATION == 'sum_top_k':
+                similarities = sorted((1 - d for d in group['distances']), reverse=True)[:k]
+                distance = 1 - sum(similarities) / k
+            else:
+                distance = min(group['distances'])
+            metadata = {key: value for key, value in group['metadata'].items() if key != 'chunk_index'}
+            aggregated.append((distance, property_id, metadata))
+
+        aggregated.sort(key=lambda x: x[0])
+        documents = self.db_manager.get_property_documents([property_id for _, property_id, _ in aggregated])
+
+        return {
+            'documents': [[documents.get(property_id, '') for _, property_id, _ in aggregated]],
+            'metadatas': [[metadata for _, _, metadata in aggregated]],
+            'distances': [[distance for distance, _, _ in aggregated]],
+            # Trozos recibidos (para saber si la bbdd ya no tiene más candidatos)
+            'fetched': len(results['documents'][0])
+        }
 
     def _apply_filters(self, metadata, filters):
         """Aplica filtros exactos a los metadatos"""
@@ -14,6 +14,8 @@ from src.embeddings_manager import EmbeddingsManager
 from src.database_manager import DatabaseManager
 from src.search_engine import PropertySearchEngine
 from src.query_enhancer import QueryEnhancer
+from src.ingestion_job import IngestionJob
+from src.near_duplicates import NearDuplicateDetector
 from src.config import Config
 
 # Configuración de página
@@ -120,15 +122,18 @@ def display_sidebar():
 
     # Upload de CSV
     uploaded_file = st.sidebar.file_uploader(
-        "Subir archivo CSV",
-        type=['csv'],
-        help="Sube un archivo CSV con datos de propiedades"
+        "Subir archivo CSV o Parquet",
+        type=['csv', 'parquet', 'feather', 'arrow'],
+        help="Sube un archivo (CSV, Parquet o Arrow) con datos de propiedades de pisos.com o habitaclia"
     )
 
     if uploaded_file is not None:
         if st.sidebar.button(" Procesar y Cargar"):
             process_uploaded_file(uploaded_file)
 
+    # Progreso de los trabajos de ingesta (leído de sus checkpoints)
+    display_ingestion_jobs()
+
     # Borrar base de datos
     st.sidebar.markdown("---")
     st.sidebar.subheader(" Resetear Sistema")
@@ -136,6 +141,44 @@ def display_sidebar():
         if st.sidebar.checkbox("Confirmar eliminación"):
             reset_database()
 
+def display_ingestion_jobs():
+    """Estado de los últimos trabajos de ingesta, con opción de reanudar"""
+    jobs = IngestionJob.list_jobs()[:3]
+    if not jobs:
+        return
+
+    st.sidebar.markdown("---")
+    st.sidebar.subheader(" Trabajos de Ingesta")
+
+    for job in jobs:
+        status = job.get_status()
+        st.sidebar.caption(f"{job.job_id} · {status['state']}")
+
+        if status.get('progress') is not None:
+            st.sidebar.progress(status['progress'])
+
+        eta = f"{status['eta_seconds']:.0f}s" if status.get('eta_seconds') else "-"
+        st.sidebar.caption(
+            f"{status.get('rows_done', 0):,} filas · {status.get('rows_per_second', 0):,.0f} filas/s · "
+            f"ETA {eta} · {status.get('tokens_used', 0):,} tokens"
+        )
+
+        if status['state'] == 'failed':
+            st.sidebar.error(f" {status['error']}")
+        # Solo si ningún proceso vivo lo está ejecutando (ver IngestionJob.lock_owner)
+        if status['state'] in ('failed', 'interrupted'):
+            if st.sidebar.button(" Reanudar", key=f"resume_{job.job_id}"):
+                try:
+                    with st.spinner(" Reanudando ingesta..."):
+                        job.resume()
+                except RuntimeError as e:
+                    st.sidebar.error(f" {e}")
+                else:
+                    st.rerun()
+
+    if st.sidebar.button(" Actualizar estado"):
+        st.rerun()
+
 def process_uploaded_file(uploaded_file):
     """Procesa el archivo CSV subido"""
     try:
@@ -146,26 +189,50 @@ def process_uploaded_file(uploaded_file):
                 f.write(uploaded_file.getvalue())
 
             # Cargar y procesar datos
-            df = pd.read_csv(temp_path)
+            df = DataProcessor.read_file(temp_path)
             st.sidebar.success(f" Archivo cargado: {len(df)} registros")
 
-            # Limpiar datos
-            df_clean = DataProcessor.clean_dataframe(df)
-
-            # Generar textos y metadata
+            # Limpiar datos y generar textos y metadata
             with st.spinner(" Generando textos descriptivos..."):
-                descriptive_texts = df_clean.apply(DataProcessor.build_descriptive_text, axis=1).tolist()
-                structured_metadata = df_clean.apply(DataProcessor.build_structured_metadata, axis=1).tolist()
-
-            # Generar embeddings
-            with st.spinner(" Generando embeddings..."):
-                embeddings_manager = EmbeddingsManager()
-                embeddings = embeddings_manager.generate_embeddings_batch(descriptive_texts, use_large_model=True)
+                df_clean, descriptive_texts, structured_metadata = DataProcessor.process_dataframe(df)
+
+            # El mismo piso publicado varias veces: se embebe una sola vez
+            if Config.NEAR_DUP_ENABLED:
+                before = len(descriptive_texts)
+                df_clean, descriptive_texts, structured_metadata = NearDuplicateDetector().deduplicate(
+                    df_clean, descriptive_texts, structured_metadata
+                )
+                st.sidebar.info(f" Casi duplicados descartados: {before - len(descriptive_texts)}")
+
+            embeddings_manager = EmbeddingsManager()
+            db_manager = DatabaseManager()
+
+            # Solo propiedades nuevas o modificadas (ids estables por URL + hash de contenido)
+            changed = db_manager.get_changed_indices(descriptive_texts, structured_metadata)
+            st.sidebar.info(f" Sin cambios (se omiten): {len(descriptive_texts) - len(changed)}")
+            df_clean = df_clean.iloc[changed]
+            descriptive_texts = [descriptive_texts[i] for i in changed]
+            structured_metadata = [structured_metadata[i] for i in changed]
+
+            if not changed:
+                st.sidebar.success(" No hay propiedades nuevas ni modificadas")
+            elif Config.CHUNKING_ENABLED:
+                # Multi-vector: un embedding por trozo de cada propiedad
+                with st.spinner(" Generando embeddings por trozos..."):
+                    chunks_per_property = df_clean.apply(DataProcessor.build_text_chunks, axis=1).tolist()
+                    chunk_texts = [chunk for chunks in chunks_per_property for chunk in chunks]
+                    embeddings = embeddings_manager.generate_embeddings_batch(chunk_texts, use_large_model=True, allow_fallback=False)
+
+                with st.spinner(" Guardando en base de datos..."):
+                    db_manager.add_property_chunks_to_db(chunks_per_property, embeddings, structured_metadata, descriptive_texts)
+            else:
+                # Generar embeddings
+                with st.spinner(" Generando embeddings..."):
+                    embeddings = embeddings_manager.generate_embeddings_batch(descriptive_texts, use_large_model=True, allow_fallback=False)
 
-            # Guardar en base de datos
-            with st.spinner(" Guardando en base de datos..."):
-                db_manager = DatabaseManager()
-                db_manager.add_properties_to_db(df_clean, descriptive_texts, embeddings, structured_metadata)
+                # Guardar en base de datos
+                with st.spinner(" Guardando en base de datos..."):
+                    db_manager.add_properties_to_db(df_clean, descriptive_texts, embeddings, structured_metadata)
 
             st.sidebar.success(" Datos procesados y guardados correctamente!")
             st.rerun()
@@ -176,8 +243,11 @@ def process_uploaded_file(uploaded_file):
 def reset_database():
     """Resetea la base de datos"""
     try:
-        if os.path.exists(Config.CHROMADB_PATH):
-            shutil.rmtree(Config.CHROMADB_PATH)
+        # A través del DatabaseManager: vacía también los índices compartidos ya
+        # cargados en el proceso (borrar los directorios los dejaría obsoletos)
+        DatabaseManager().reset_database()
+        # El motor de la sesión guarda la referencia a la colección borrada
+        st.session_state.pop('search_engine', None)
         st.sidebar.success(" Base de datos eliminada")
         st.rerun()
     except Exception as e:
@@ -332,16 +402,28 @@ def main():
     # Procesamiento de búsqueda
     if (search_button or query) and query.strip():
         try:
-            # Análisis con LLM
-            query_info = st.session_state.query_enhancer.get_enhanced_query_info(query, show_analysis=False)
+            results = None
+            if not test_mode and Config.SPECULATIVE_SEARCH:
+                # Análisis LLM y búsqueda en paralelo (una sola llamada al LLM)
+                with st.spinner(" Buscando propiedades..."):
+                    results = st.session_state.search_engine.speculative_search(
+                        query, n_results=num_results, show_analysis=False
+                    )
+                query_info = st.session_state.search_engine.last_query_info
+                if query_info is None:
+                    st.info(" El análisis LLM tardó demasiado: resultados de la consulta original")
+            else:
+                # Análisis con LLM
+                query_info = st.session_state.query_enhancer.get_enhanced_query_info(query, show_analysis=False)
 
-            if show_analysis:
+            if show_analysis and query_info:
                 display_llm_analysis(query_info, query)
 
             if not test_mode:
                 # Realizar búsqueda
-                with st.spinner(" Buscando propiedades..."):
-                    results = st.session_state.search_engine.search(query, n_results=num_results)
+                if results is None:
+                    with st.spinner(" Buscando propiedades..."):
+                        results = st.session_state.search_engine.search(query, n_results=num_results)
 
                 # Mostrar resultados
                 if results: